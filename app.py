@@ -12,16 +12,30 @@
 
 import streamlit as st
 import pandas as pd
-import sqlite3
-from datetime import datetime, date
+from datetime import date, timedelta
 from pathlib import Path
 import uuid
 import bcrypt
-from io import BytesIO
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
+from collections import OrderedDict
+import threading
+import time
+from dataclasses import replace
 
 import plotly.express as px
 
+from datos import (
+    CATEGORIAS_MATERIAL, FILES_DIR, HISTORIAL_ESTATUS, HistorialQuery, JOBS_DIR, JOB_ACTIVOS, JOB_TIPOS, LINEAS,
+    LINEAS_POR_PRACTICANTE, MaterialesQuery, SQL_LENTA_MS, SQL_REPETIDA_N, STATUS, aplicar_transiciones,
+    conteo_por_estatus, conteo_semanal, count_materiales, cronometrado, cronometro, db, df_read_archivos,
+    df_read_materiales, diff_semanas, encolar_job, export_cache, export_payload, file_sha256, generar_id_solicitud,
+    guardar_archivo_versionado, historial_pagina, ingest_solicitud, iniciar_rerun, init_db, iso_week, job_runner,
+    leer_importacion, listar_jobs, material_ids, metricas_buffer, nuevo_registro, percentiles_metricas,
+    preview_paths, query_materiales, read_data_version, read_material, read_sql, reintentar_job, resumen_rerun,
+    snapshot_scheduler, snapshot_sheets, snapshots_congelados, sql_del_rerun, sql_log, template_sheets,
+    update_estatus_material, validate_record, verify_query_plans,
+)
+
 # ---------------------------
 # STREAMLIT CONFIG (MUST BE FIRST)
 # ---------------------------
@@ -136,86 +150,62 @@ section[data-testid="stSidebar"] {{
 # ---------------------------
 # SVG ICONS (no emojis)
 # ---------------------------
+HTML_CACHE_MAX_ITEMS = 4096
+
+class HtmlCache:
+    """Fragmentos HTML ya armados (iconos, leyenda, KPIs, tarjetas) por llave de entradas; LRU acotado por entradas."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, build: Callable[[], str]) -> str:
+        with self._lock:
+            html = self._items.get(key)
+            if html is not None:
+                self._items.move_to_end(key)
+                return html
+        html = build()
+        with self._lock:
+            self._items[key] = html
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return html
+
+@st.cache_resource(show_spinner=False)
+def html_cache() -> HtmlCache:
+    return HtmlCache(HTML_CACHE_MAX_ITEMS)
+
+# Se resuelve una vez por rerun; el cache en sí vive todo el proceso.
+HTML_CACHE = html_cache()
+
+# Trazos de cada icono; el <svg> completo se arma una vez por (icono, color, tamaño).
+SVG_ICON_PATHS = {
+    "user": '<path d="M20 21a8 8 0 0 0-16 0"/><circle cx="12" cy="7" r="4"/>',
+    "logout": '<path d="M9 21H5a2 2 0 0 1-2-2V5a2 2 0 0 1 2-2h4"/><path d="M16 17l5-5-5-5"/><path d="M21 12H9"/>',
+    "pending": '<path d="M12 8v5l3 3"/><circle cx="12" cy="12" r="10"/>',
+    "dashboard": '<path d="M3 3h18v18H3z"/><path d="M7 13h3v6H7z"/><path d="M14 7h3v12h-3z"/>',
+    "search": '<circle cx="11" cy="11" r="7"/><path d="M21 21l-4.3-4.3"/>',
+    "update": '<path d="M21 12a9 9 0 1 1-2.6-6.4"/><path d="M21 3v6h-6"/>',
+    "plus": '<path d="M12 5v14"/><path d="M5 12h14"/>',
+    "download": '<path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/><path d="M7 10l5 5 5-5"/><path d="M12 15V3"/>',
+    "file": '<path d="M14 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V8z"/><path d="M14 2v6h6"/>',
+    "chart": '<path d="M3 3v18h18"/><path d="M7 14l3-3 4 4 6-7"/>',
+}
+
 def svg_icon(name: str, color: str = BOSCH_BLUE, size: int = 18) -> str:
-    icons = {
-        "user": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M20 21a8 8 0 0 0-16 0"/>
-  <circle cx="12" cy="7" r="4"/>
-</svg>""",
-        "logout": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M9 21H5a2 2 0 0 1-2-2V5a2 2 0 0 1 2-2h4"/>
-  <path d="M16 17l5-5-5-5"/>
-  <path d="M21 12H9"/>
-</svg>""",
-        "pending": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M12 8v5l3 3"/>
-  <circle cx="12" cy="12" r="10"/>
-</svg>""",
-        "dashboard": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M3 3h18v18H3z"/>
-  <path d="M7 13h3v6H7z"/>
-  <path d="M14 7h3v12h-3z"/>
-</svg>""",
-        "search": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <circle cx="11" cy="11" r="7"/>
-  <path d="M21 21l-4.3-4.3"/>
-</svg>""",
-        "update": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M21 12a9 9 0 1 1-2.6-6.4"/>
-  <path d="M21 3v6h-6"/>
-</svg>""",
-        "plus": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M12 5v14"/>
-  <path d="M5 12h14"/>
-</svg>""",
-        "download": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/>
-  <path d="M7 10l5 5 5-5"/>
-  <path d="M12 15V3"/>
-</svg>""",
-        "file": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M14 2H6a2 2 0 0 0-2 2v16a2 2 0 0 0 2 2h12a2 2 0 0 0 2-2V8z"/>
-  <path d="M14 2v6h6"/>
-</svg>""",
-        "chart": f"""
-<svg class="icon" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M3 3v18h18"/>
-  <path d="M7 14l3-3 4 4 6-7"/>
-</svg>""",
-    }
-    s = icons.get(name, icons["file"])
-    if size >= 20:
-        s = s.replace('class="icon"', 'class="icon-lg"')
-    return s
+    def build() -> str:
+        cls = "icon-lg" if size >= 20 else "icon"
+        return (
+            f'<svg class="{cls}" viewBox="0 0 24 24" fill="none" stroke="{color}" stroke-width="2" '
+            f'stroke-linecap="round" stroke-linejoin="round">{SVG_ICON_PATHS.get(name, SVG_ICON_PATHS["file"])}</svg>'
+        )
+    return HTML_CACHE.get(("icon", name, color, size), build)
 
 # ---------------------------
-# CONSTANTS
+# STATUS BADGES
 # ---------------------------
-APP_DIR = Path(__file__).parent if "__file__" in globals() else Path(".")
-DB_PATH = APP_DIR / "bd_materiales.sqlite"
-FILES_DIR = APP_DIR / "archivos_materiales"
-FILES_DIR.mkdir(parents=True, exist_ok=True)
-
-CATEGORIAS_MATERIAL = ["MAZE", "FHMI", "HIBE"]
-
-STATUS = [
-    "En revisión de ingeniería",
-    "En cotización",
-    "En alta SAP",
-    "En espera de InfoRecord",
-    "Info record creado",
-    "Alta finalizada",
-]
-
 STATUS_BADGE_CLASS = {
     "En revisión de ingeniería": "badge-rev",
     "En cotización": "badge-cot",
@@ -225,22 +215,9 @@ STATUS_BADGE_CLASS = {
     "Alta finalizada": "badge-fin",
 }
 
-FECHA_MAP = {
-    "En revisión de ingeniería": "Fecha_Revision",
-    "En cotización": "Fecha_Cotizacion",
-    "En alta SAP": "Fecha_Alta_SAP",
-    "En espera de InfoRecord": "Fecha_InfoRecord",
-    "Info record creado": "Fecha_InfoRecord",
-    "Alta finalizada": "Fecha_Finalizada",
-}
-
-LINEAS_POR_PRACTICANTE = {
-    "Jarol": ["DP 02", "SCU 33", "SCU 34", "SCU 48", "SSL1"],
-    "Lalo": ["APA 36", "APA 38", "SERVO 10", "SERVO 24"],
-    "Jime": ["DP 32", "DP 35", "SENSOR 28", "SENSOR 5"],
-    "Niko": ["KGT 22", "KGT 23", "LG 01", "LG 03"],
-}
-LINEAS = sorted(list(set(sum(LINEAS_POR_PRACTICANTE.values(), []))))
+def badge_html(status: str) -> str:
+    cls = STATUS_BADGE_CLASS.get(status, "badge-rev")
+    return f'<span class="badge {cls}">{status}</span>'
 
 # ---------------------------
 # STATUS COLORS (table styling)
@@ -254,32 +231,31 @@ STATUS_COLOR = {
     "Alta finalizada": {"bg": "#BBDEFB", "fg": "#0D47A1"},           # azul (confirmada)
 }
 
-def _style_status_cell(val: str) -> str:
-    d = STATUS_COLOR.get(str(val), {"bg": "#EEEEEE", "fg": "#333333"})
-    return f"background-color: {d['bg']}; color: {d['fg']}; font-weight: 900;"
+def _status_css(font_weight: int) -> Dict[str, str]:
+    return {s: f"background-color: {d['bg']}; color: {d['fg']}; font-weight: {font_weight};" for s, d in STATUS_COLOR.items()}
+
+STATUS_CELL_CSS = _status_css(900)
+STATUS_ROW_CSS = _status_css(650)
 
 def style_df_by_status(df: pd.DataFrame, status_col: str = "Estatus", highlight_row: bool = False):
+    """Styler con el color del estatus; el CSS se arma por columna (map de Series), no celda por celda en Python.
+
+    st.dataframe solo toma colores/peso de fuente del Styler, así que no se agregan bordes ni table_styles.
+    Pensado para la página visible: render_table nunca le pasa más de PAGE_SIZE filas.
+    """
     if df is None or df.empty or status_col not in df.columns:
         return df
 
-    styler = df.style
+    css_map, default = (STATUS_ROW_CSS, "background-color: #FFFFFF; color: #000000; font-weight: 650;") if highlight_row else (STATUS_CELL_CSS, "background-color: #EEEEEE; color: #333333; font-weight: 900;")
+    css = df[status_col].astype(str).map(css_map).fillna(default).to_numpy()
 
-    if highlight_row:
-        def row_style(row):
-            d = STATUS_COLOR.get(str(row[status_col]), {"bg": "#FFFFFF", "fg": "#000000"})
-            return [f"background-color: {d['bg']}; color: {d['fg']}; font-weight: 650;" for _ in row]
-        styler = styler.apply(row_style, axis=1)
-    else:
-        styler = styler.map(_style_status_cell, subset=[status_col])
+    def estilos(frame: pd.DataFrame) -> pd.DataFrame:
+        out = pd.DataFrame("", index=frame.index, columns=frame.columns)
+        for c in (frame.columns if highlight_row else [status_col]):
+            out[c] = css
+        return out
 
-    styler = styler.set_properties(**{
-        "border": "1px solid rgba(0,0,0,0.06)",
-        "font-size": "0.92rem"
-    }).set_table_styles([
-        {"selector": "th", "props": [("background-color", BOSCH_GRAY), ("color", BOSCH_BLUE), ("font-weight", "900")]},
-        {"selector": "td", "props": [("padding", "10px 10px")]},
-    ])
-    return styler
+    return df.style.apply(estilos, axis=None)
 
 # ---------------------------
 # USERS / AUTH (prefer st.secrets)
@@ -293,368 +269,157 @@ def _bcrypt_check(plain: str, hashed: str) -> bool:
     except Exception:
         return False
 
+# Demo fallback (move to secrets for production): se hashea una sola vez y queda guardado en la tabla usuarios.
+DEMO_USERS = {
+    "jarol": ("jarol123", "practicante", "Jarol"),
+    "lalo":  ("lalo123",  "practicante", "Lalo"),
+    "jime":  ("jime123",  "practicante", "Jime"),
+    "niko":  ("niko123",  "practicante", "Niko"),
+    "admin": ("admin123", "jefa",        "Admin"),
+}
+
+LOGIN_SLOTS = 2
+LOGIN_MAX_FALLOS = 5
+LOGIN_BLOQUEO_S = 30
+LOGIN_BLOQUEO_MAX_S = 15 * 60
+LOGIN_FALLOS_MAX = 10000
+
 def load_users() -> Dict[str, Dict[str, str]]:
     try:
         if "users" in st.secrets:
-            return dict(st.secrets["users"])  # type: ignore
+            return {u: dict(d) for u, d in st.secrets["users"].items()}  # type: ignore
     except Exception:
         pass
 
-    # Demo fallback (move to secrets for production)
-    return {
-        "jarol": {"pwd_hash": _bcrypt_hash("jarol123"), "rol": "practicante", "responsable": "Jarol"},
-        "lalo":  {"pwd_hash": _bcrypt_hash("lalo123"),  "rol": "practicante", "responsable": "Lalo"},
-        "jime":  {"pwd_hash": _bcrypt_hash("jime123"),  "rol": "practicante", "responsable": "Jime"},
-        "niko":  {"pwd_hash": _bcrypt_hash("niko123"),  "rol": "practicante", "responsable": "Niko"},
-        "admin": {"pwd_hash": _bcrypt_hash("admin123"), "rol": "jefa",        "responsable": "Admin"},
-    }
-
-USERS = load_users()
-
-# ---------------------------
-# DB LAYER (SQLite)
-# ---------------------------
-def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
     conn = db()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS materiales (
-            ID_Material TEXT PRIMARY KEY,
-            ID_Solicitud TEXT,
-            Fecha_Solicitud TEXT,
-            Ingeniero TEXT,
-            Linea TEXT,
-            Prioridad TEXT,
-            Comentario_Solicitud TEXT,
-            Item TEXT,
-            Descripcion TEXT,
-            Estacion TEXT,
-            Categoria TEXT,
-            Frecuencia_Cambio TEXT,
-            Cant_Stock_Requerida REAL,
-            Cant_Equipos INTEGER,
-            Cant_Partes_Equipo INTEGER,
-            RP_Sugerido TEXT,
-            Manufacturer TEXT,
-            Estatus TEXT,
-            Practicante_Asignado TEXT,
-            Comentario_Estatus TEXT,
-            Material_SAP TEXT,
-            InfoRecord_SAP TEXT,
-            Fecha_Revision TEXT,
-            Fecha_Cotizacion TEXT,
-            Fecha_Alta_SAP TEXT,
-            Fecha_InfoRecord TEXT,
-            Fecha_Finalizada TEXT
+    rows = conn.execute("SELECT Usuario, Pwd_Hash, Rol, Responsable FROM usuarios").fetchall()
+    if not rows:
+        conn.executemany(
+            "INSERT OR IGNORE INTO usuarios (Usuario, Pwd_Hash, Rol, Responsable) VALUES (?,?,?,?)",
+            [(u, _bcrypt_hash(pwd), rol, resp) for u, (pwd, rol, resp) in DEMO_USERS.items()],
         )
-        """
-    )
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS historial (
-            ID_Evento TEXT PRIMARY KEY,
-            ID_Material TEXT,
-            Fecha_Evento TEXT,
-            Usuario TEXT,
-            Rol TEXT,
-            Estatus_Anterior TEXT,
-            Estatus_Nuevo TEXT,
-            Comentario TEXT
-        )
-        """
-    )
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS archivos (
-            ID_Archivo TEXT PRIMARY KEY,
-            ID_Material TEXT,
-            Version INTEGER,
-            Nombre_Original TEXT,
-            Nombre_Almacenado TEXT,
-            Mime TEXT,
-            Size_Bytes INTEGER,
-            Fecha_Subida TEXT,
-            Subido_Por TEXT
-        )
-        """
-    )
-
-    conn.commit()
+        conn.commit()
+        rows = conn.execute("SELECT Usuario, Pwd_Hash, Rol, Responsable FROM usuarios").fetchall()
     conn.close()
-
-init_db()
-
-# ---------------------------
-# UTILS
-# ---------------------------
-def now_iso() -> str:
-    return datetime.now().isoformat(timespec="seconds")
-
-def generar_id_solicitud() -> str:
-    return f"SOL-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-
-def generar_id_material() -> str:
-    return f"MAT-{uuid.uuid4().hex[:8].upper()}"
-
-def iso_week(d: Optional[pd.Timestamp]) -> Optional[str]:
-    if d is None or pd.isna(d):
-        return None
+    return {r["Usuario"]: {"pwd_hash": r["Pwd_Hash"], "rol": r["Rol"], "responsable": r["Responsable"]} for r in rows}
+
+@st.cache_resource(show_spinner=False)
+def user_directory() -> Dict[str, Dict[str, str]]:
+    # Una vez por proceso: los reruns ya no tocan secrets ni bcrypt.
+    return load_users()
+
+class LoginThrottle:
+    """Fallos de login por usuario; tras LOGIN_MAX_FALLOS bloquea con espera creciente (duplica por fallo extra).
+
+    Acotado: cualquiera puede probar nombres inventados, así que los fallos se olvidan tras `bloqueo_max_s` sin
+    intentos y, pasando de `max_usuarios`, se descarta el usuario con el fallo más viejo (LRU).
+    """
+
+    def __init__(self, max_fallos: int, bloqueo_s: int, bloqueo_max_s: int, max_usuarios: int):
+        self.max_fallos = max_fallos
+        self.bloqueo_s = bloqueo_s
+        self.bloqueo_max_s = bloqueo_max_s
+        self.max_usuarios = max_usuarios
+        # usuario -> (fallos, bloqueado hasta, último fallo); en orden del último fallo.
+        self._fallos: "OrderedDict[str, tuple[int, float, float]]" = OrderedDict()
+        self._en_curso: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _expirar(self, ahora: float) -> None:
+        # El bloqueo nunca dura más de bloqueo_max_s desde el último fallo: basta revisar el frente de la cola.
+        while self._fallos and next(iter(self._fallos.values()))[2] + self.bloqueo_max_s <= ahora:
+            self._fallos.popitem(last=False)
+
+    def reservar(self, usuario: str) -> str:
+        """"" si se puede intentar (y marca el intento en curso); si no, el mensaje para el usuario."""
+        with self._lock:
+            if usuario in self._en_curso:
+                return "Ya hay un intento de acceso en curso para este usuario; espera un momento."
+            ahora = time.monotonic()
+            self._expirar(ahora)
+            _, hasta, _ = self._fallos.get(usuario, (0, 0.0, 0.0))
+            if hasta > ahora:
+                return f"Demasiados intentos fallidos. Intenta de nuevo en {int(hasta - ahora) + 1} s."
+            self._en_curso.add(usuario)
+            return ""
+
+    def registrar(self, usuario: str, ok: bool) -> None:
+        with self._lock:
+            self._en_curso.discard(usuario)
+            if ok:
+                self._fallos.pop(usuario, None)
+                return
+            ahora = time.monotonic()
+            fallos = self._fallos.pop(usuario, (0, 0.0, 0.0))[0] + 1
+            hasta = 0.0
+            if fallos >= self.max_fallos:
+                hasta = ahora + min(self.bloqueo_max_s, self.bloqueo_s * 2 ** (fallos - self.max_fallos))
+            self._fallos[usuario] = (fallos, hasta, ahora)
+            while len(self._fallos) > self.max_usuarios:
+                self._fallos.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def login_throttle() -> LoginThrottle:
+    return LoginThrottle(LOGIN_MAX_FALLOS, LOGIN_BLOQUEO_S, LOGIN_BLOQUEO_MAX_S, LOGIN_FALLOS_MAX)
+
+@st.cache_resource(show_spinner=False)
+def _login_slots() -> threading.BoundedSemaphore:
+    # Cuántos bcrypt pueden correr a la vez en el proceso: una ráfaga de logins no se come el CPU de los reruns de
+    # las demás sesiones. No es asíncrono: la sesión que hace login espera su hash (y su turno si no hay lugar).
+    return threading.BoundedSemaphore(LOGIN_SLOTS)
+
+@st.cache_resource(show_spinner=False)
+def _dummy_hash() -> str:
+    # Para usuarios inexistentes se compara igual contra un hash: mismo tiempo de respuesta que un usuario real.
+    return _bcrypt_hash(uuid.uuid4().hex)
+
+def verificar_login(usuario: str, pwd: str) -> tuple[Optional[dict], str]:
+    """Regresa (datos del usuario, "") si las credenciales son válidas; si no, (None, mensaje de error)."""
+    throttle = login_throttle()
+    error = throttle.reservar(usuario)
+    if error:
+        return None, error
+
+    u = user_directory().get(usuario)
+    ok = False
     try:
-        y, w, _ = d.isocalendar()
-        return f"{y}-W{int(w):02d}"
-    except Exception:
-        return None
-
-def badge_html(status: str) -> str:
-    cls = STATUS_BADGE_CLASS.get(status, "badge-rev")
-    return f'<span class="badge {cls}">{status}</span>'
-
-def safe_to_datetime(series: pd.Series) -> pd.Series:
-    return pd.to_datetime(series, errors="coerce")
-
-def df_read_materiales() -> pd.DataFrame:
-    conn = db()
-    df = pd.read_sql_query("SELECT * FROM materiales", conn)
-    conn.close()
-    if len(df) == 0:
-        return df
-    for c in ["Fecha_Solicitud", "Fecha_Revision", "Fecha_Cotizacion", "Fecha_Alta_SAP", "Fecha_InfoRecord", "Fecha_Finalizada"]:
-        if c in df.columns:
-            df[c] = safe_to_datetime(df[c])
-    return df
-
-def df_read_historial(material_id: Optional[str] = None) -> pd.DataFrame:
-    conn = db()
-    if material_id:
-        df = pd.read_sql_query(
-            "SELECT * FROM historial WHERE ID_Material = ? ORDER BY Fecha_Evento DESC",
-            conn,
-            params=[material_id],
-        )
-    else:
-        df = pd.read_sql_query("SELECT * FROM historial ORDER BY Fecha_Evento DESC", conn)
-    conn.close()
-    if len(df) and "Fecha_Evento" in df.columns:
-        df["Fecha_Evento"] = safe_to_datetime(df["Fecha_Evento"])
-    return df
-
-def df_read_archivos(material_id: str) -> pd.DataFrame:
-    conn = db()
-    df = pd.read_sql_query(
-        "SELECT * FROM archivos WHERE ID_Material = ? ORDER BY Version DESC",
-        conn,
-        params=[material_id],
-    )
-    conn.close()
-    if len(df) and "Fecha_Subida" in df.columns:
-        df["Fecha_Subida"] = safe_to_datetime(df["Fecha_Subida"])
-    return df
-
-def insert_materiales(registros: list[dict]) -> None:
-    conn = db()
-    cur = conn.cursor()
-    for r in registros:
-        cur.execute(
-            """
-            INSERT INTO materiales (
-                ID_Material, ID_Solicitud, Fecha_Solicitud, Ingeniero, Linea, Prioridad, Comentario_Solicitud,
-                Item, Descripcion, Estacion, Categoria, Frecuencia_Cambio, Cant_Stock_Requerida, Cant_Equipos,
-                Cant_Partes_Equipo, RP_Sugerido, Manufacturer, Estatus, Practicante_Asignado,
-                Comentario_Estatus, Material_SAP, InfoRecord_SAP,
-                Fecha_Revision, Fecha_Cotizacion, Fecha_Alta_SAP, Fecha_InfoRecord, Fecha_Finalizada
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-            (
-                r["ID_Material"], r["ID_Solicitud"], r["Fecha_Solicitud"], r["Ingeniero"], r["Linea"], r["Prioridad"],
-                r.get("Comentario_Solicitud",""),
-                r.get("Item",""), r["Descripcion"], r.get("Estacion",""), r.get("Categoria",""),
-                r.get("Frecuencia_Cambio",""),
-                float(r.get("Cant_Stock_Requerida", 0.0)),
-                int(r.get("Cant_Equipos", 0)),
-                int(r.get("Cant_Partes_Equipo", 0)),
-                r.get("RP_Sugerido",""), r.get("Manufacturer",""),
-                r.get("Estatus","En revisión de ingeniería"),
-                r.get("Practicante_Asignado",""),
-                r.get("Comentario_Estatus",""),
-                r.get("Material_SAP",""),
-                r.get("InfoRecord_SAP",""),
-                r.get("Fecha_Revision"),
-                r.get("Fecha_Cotizacion"),
-                r.get("Fecha_Alta_SAP"),
-                r.get("Fecha_InfoRecord"),
-                r.get("Fecha_Finalizada"),
-            ),
-        )
-    conn.commit()
-    conn.close()
-
-def write_historial_event(id_material: str, estatus_old: str, estatus_new: str, comentario: str, usuario: str, rol: str):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO historial (
-            ID_Evento, ID_Material, Fecha_Evento, Usuario, Rol, Estatus_Anterior, Estatus_Nuevo, Comentario
-        ) VALUES (?,?,?,?,?,?,?,?)
-        """,
-        (f"EVT-{uuid.uuid4().hex[:12].upper()}", id_material, now_iso(), usuario, rol, estatus_old, estatus_new, comentario),
-    )
-    conn.commit()
-    conn.close()
-
-def update_estatus_material(
-    id_material: str,
-    nuevo_estatus: str,
-    comentario: str,
-    usuario: str,
-    rol: str,
-    material_sap: Optional[str] = None,
-    inforecord_sap: Optional[str] = None,
-) -> bool:
-    conn = db()
-    cur = conn.cursor()
-    row = cur.execute("SELECT Estatus FROM materiales WHERE ID_Material = ?", (id_material,)).fetchone()
-    if not row:
-        conn.close()
-        return False
-
-    estatus_old = row["Estatus"]
-
-    fecha_col = FECHA_MAP.get(nuevo_estatus)
-    fields = ["Estatus = ?", "Comentario_Estatus = ?"]
-    params = [nuevo_estatus, comentario]
-
-    if material_sap is not None:
-        fields.append("Material_SAP = ?")
-        params.append(material_sap)
-    if inforecord_sap is not None:
-        fields.append("InfoRecord_SAP = ?")
-        params.append(inforecord_sap)
-
-    if fecha_col:
-        fields.append(f"{fecha_col} = ?")
-        params.append(now_iso())
-
-    params.append(id_material)
-    cur.execute(f"UPDATE materiales SET {', '.join(fields)} WHERE ID_Material = ?", params)
-    conn.commit()
-    conn.close()
-
-    write_historial_event(id_material, estatus_old, nuevo_estatus, comentario, usuario, rol)
-    return True
-
-def guardar_archivo_versionado(uploaded_file, id_material: str, usuario: str) -> Optional[dict]:
-    if uploaded_file is None:
-        return None
-
-    df_arch = df_read_archivos(id_material)
-    next_version = 1 if df_arch.empty else int(df_arch["Version"].max()) + 1
-
-    original_name = uploaded_file.name
-    ext = Path(original_name).suffix.lower()[:12]
-    stored_name = f"{id_material}_v{next_version}{ext}"
-    stored_path = FILES_DIR / stored_name
-
-    data = uploaded_file.getbuffer()
-    stored_path.write_bytes(data)
-
-    meta = {
-        "ID_Archivo": f"FILE-{uuid.uuid4().hex[:12].upper()}",
-        "ID_Material": id_material,
-        "Version": next_version,
-        "Nombre_Original": original_name,
-        "Nombre_Almacenado": stored_name,
-        "Mime": uploaded_file.type or "",
-        "Size_Bytes": int(len(data)),
-        "Fecha_Subida": now_iso(),
-        "Subido_Por": usuario,
-    }
-
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO archivos (
-            ID_Archivo, ID_Material, Version, Nombre_Original, Nombre_Almacenado,
-            Mime, Size_Bytes, Fecha_Subida, Subido_Por
-        ) VALUES (?,?,?,?,?,?,?,?,?)
-        """,
-        (
-            meta["ID_Archivo"], meta["ID_Material"], meta["Version"], meta["Nombre_Original"],
-            meta["Nombre_Almacenado"], meta["Mime"], meta["Size_Bytes"], meta["Fecha_Subida"], meta["Subido_Por"]
-        ),
-    )
-    conn.commit()
-    conn.close()
-    return meta
-
-def excel_bytes_from_dfs(sheets: Dict[str, pd.DataFrame]) -> bytes:
-    bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        for name, df in sheets.items():
-            df.to_excel(writer, sheet_name=name[:31], index=False)
-    return bio.getvalue()
-
-def template_excel_bytes() -> bytes:
-    cols = [
-        "Ingeniero", "Linea", "Prioridad", "Comentario_Solicitud",
-        "Item", "Descripcion", "Estacion", "Categoria",
-        "Frecuencia_Cambio", "Cant_Stock_Requerida", "Cant_Equipos", "Cant_Partes_Equipo",
-        "RP_Sugerido", "Manufacturer"
-    ]
-    df = pd.DataFrame(columns=cols)
-    info = pd.DataFrame(
-        [
-            ["INSTRUCCIONES",
-             "1) No borres encabezados. 2) 'Descripcion' obligatoria. 3) Categoria: MAZE/FHMI/HIBE.",
-             "4) Linea debe existir en catálogo. 5) Prioridad: Alta/Media/Baja. 6) Sube el archivo en 'Excel masivo'."]
-        ],
-        columns=["Campo", "Regla", "Notas"]
-    )
-    return excel_bytes_from_dfs({"Template": df, "Guia": info})
-
-def validate_record(r: dict) -> list[str]:
-    errors = []
-    if not str(r.get("Descripcion","")).strip():
-        errors.append("Descripcion obligatoria.")
-    if str(r.get("Linea","")) not in LINEAS:
-        errors.append("Linea inválida (fuera de catálogo).")
-    if str(r.get("Prioridad","")) not in ["Alta","Media","Baja"]:
-        errors.append("Prioridad inválida.")
-    if str(r.get("Categoria","")) and str(r.get("Categoria","")) not in CATEGORIAS_MATERIAL:
-        errors.append("Categoria inválida.")
-    try:
-        stock = float(r.get("Cant_Stock_Requerida", 0) or 0)
-        if stock < 0:
-            errors.append("Cant_Stock_Requerida no puede ser negativa.")
-    except Exception:
-        errors.append("Cant_Stock_Requerida debe ser numérica.")
-    return errors
-
-def assign_practicante(linea: str) -> str:
-    for resp, lineas in LINEAS_POR_PRACTICANTE.items():
-        if linea in lineas:
-            return resp
-    return ""
+        with _login_slots():
+            ok = _bcrypt_check(pwd, u["pwd_hash"] if u else _dummy_hash()) and u is not None
+    finally:
+        throttle.registrar(usuario, ok)
+    return (u, "") if ok else (None, "Usuario o contraseña incorrectos")
 
 def require_login():
     if not st.session_state.get("logged", False):
+        cerrar_rerun()
         st.stop()
 
 def require_role(allowed: list[str]):
     if st.session_state.get("rol") not in allowed:
         st.error("Acceso denegado: no tienes permisos para esta sección.")
+        cerrar_rerun()
         st.stop()
 
+init_db()
+verify_query_plans()
+job_runner()
+snapshot_scheduler()
+
+# Muestras de tiempo de este rerun; se cierran y se muestran (jefa) al final del script.
+RERUN_T0 = time.perf_counter()
+MUESTRAS_RERUN = iniciar_rerun()
+
+def cerrar_rerun() -> float:
+    """Registra el tiempo total del rerun y vacía el buffer de métricas; regresa los ms.
+
+    st.stop() / st.rerun() cortan el script con una excepción y nunca llegan al final: se llama justo antes de
+    cada uno (y al final del script). Un rerun de fragmento no vuelve a correr RERUN_T0: ahí solo se vacía el buffer.
+    """
+    ms = (time.perf_counter() - RERUN_T0) * 1000
+    metricas_buffer().agregar("rerun", ms)
+    metricas_buffer().vaciar()
+    return ms
+
 # ---------------------------
 # SESSION STATE
 # ---------------------------
@@ -685,16 +450,18 @@ if not st.session_state.logged:
         pwd = st.text_input("Contraseña", type="password", placeholder="••••••••")
 
     if st.button("Acceder", use_container_width=True):
-        u = USERS.get(user)
-        if u and _bcrypt_check(pwd, u["pwd_hash"]):
+        u, error = verificar_login(user, pwd)
+        if u:
             st.session_state.logged = True
             st.session_state.user = user
             st.session_state.rol = u["rol"]
             st.session_state.responsable = u["responsable"]
+            cerrar_rerun()
             st.rerun()
         else:
-            st.error("Usuario o contraseña incorrectos")
+            st.error(error)
 
+    cerrar_rerun()
     st.stop()
 
 # ---------------------------
@@ -719,21 +486,18 @@ with h3:
     if st.button("Cerrar sesión", use_container_width=True):
         for k in list(st.session_state.keys()):
             del st.session_state[k]
+        cerrar_rerun()
         st.rerun()
 
-# ---------------------------
-# LOAD DATA
-# ---------------------------
-df_materiales = df_read_materiales()
-
 # ---------------------------
 # UI HELPERS
 # ---------------------------
-def kpi_row(df: pd.DataFrame):
-    if df is None or df.empty:
+PAGE_SIZE = 50
+
+def kpi_row(counts: Dict[str, int]):
+    if not counts or not sum(counts.values()):
         st.info("No hay datos para mostrar.")
         return
-    counts = {s: int((df["Estatus"] == s).sum()) for s in STATUS}
 
     items = [
         ("Revisión", counts["En revisión de ingeniería"], "search", "#2E2E2E"),
@@ -745,21 +509,32 @@ def kpi_row(df: pd.DataFrame):
     ]
 
     cols = st.columns(6)
-    for col, (label, val, icon, ic_color) in zip(cols, items):
-        col.markdown(
-            f"""
-<div class="kpi">
-  <div class="kpi-left">
-    {svg_icon(icon, color=ic_color, size=20)}
-    <div class="label">{label}</div>
-  </div>
-  <div class="value">{val}</div>
-</div>
-""",
-            unsafe_allow_html=True,
-        )
+    for col, item in zip(cols, items):
+        col.markdown(kpi_html(*item), unsafe_allow_html=True)
+
+def kpi_html(label: str, val: int, icon: str, ic_color: str) -> str:
+    return HTML_CACHE.get(
+        ("kpi", label, val, icon, ic_color),
+        lambda: (
+            f'<div class="kpi"><div class="kpi-left">{svg_icon(icon, color=ic_color, size=20)}'
+            f'<div class="label">{label}</div></div><div class="value">{val}</div></div>'
+        ),
+    )
 
-def render_legend():
+def paginador(total: int, key: str, page_size: int = PAGE_SIZE) -> int:
+    """Selector de página para las vistas de lista; regresa el offset a pedir en SQL."""
+    paginas = max(1, -(-total // page_size))
+    if st.session_state.get(key, 1) > paginas:
+        st.session_state[key] = 1
+    c1, c2 = st.columns([1, 3])
+    with c1:
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1, step=1, key=key)
+    offset = (int(pagina) - 1) * page_size
+    with c2:
+        st.caption(f"Mostrando {min(offset + 1, total)}–{min(offset + page_size, total)} de {total}")
+    return offset
+
+def _legend_html() -> str:
     chips = []
     for s in STATUS:
         d = STATUS_COLOR[s]
@@ -767,13 +542,31 @@ def render_legend():
             f"<span style='display:inline-block;margin:4px 6px;padding:6px 10px;border-radius:999px;"
             f"background:{d['bg']};color:{d['fg']};font-weight:900;font-size:.82rem;'>{s}</span>"
         )
-    st.markdown("<div class='card'><div class='card-title'>Leyenda de estatus</div>" + "".join(chips) + "</div>", unsafe_allow_html=True)
+    return "<div class='card'><div class='card-title'>Leyenda de estatus</div>" + "".join(chips) + "</div>"
+
+def render_legend():
+    st.markdown(HTML_CACHE.get(("legend",), _legend_html), unsafe_allow_html=True)
+
+TABLA_COLUMN_CONFIG = {
+    "Fecha_Solicitud": st.column_config.DatetimeColumn("Fecha_Solicitud", format="YYYY-MM-DD HH:mm"),
+    "Descripcion": st.column_config.TextColumn("Descripcion", width="large"),
+    "Estatus": st.column_config.TextColumn("Estatus", width="medium"),
+    "Cant_Stock_Requerida": st.column_config.NumberColumn("Cant_Stock_Requerida", format="%g"),
+    "Cant_Equipos": st.column_config.NumberColumn("Cant_Equipos", format="%d"),
+    "Cant_Partes_Equipo": st.column_config.NumberColumn("Cant_Partes_Equipo", format="%d"),
+}
 
-def render_table(df: pd.DataFrame, compact: bool, highlight_row: bool = False):
+@cronometrado("render_table")
+def render_table(df: pd.DataFrame, compact: bool, highlight_row: bool = False, key: str = "tabla_pag"):
     if df.empty:
         st.info("No hay registros.")
         return
 
+    if len(df) > PAGE_SIZE:
+        # Frames completos: el Styler solo se arma para la página visible.
+        offset = paginador(len(df), key)
+        df = df.iloc[offset:offset + PAGE_SIZE]
+
     if compact:
         cols = ["ID_Solicitud", "Linea", "Descripcion", "Prioridad", "Estatus"]
         cols = [c for c in cols if c in df.columns]
@@ -802,10 +595,52 @@ def render_table(df: pd.DataFrame, compact: bool, highlight_row: bool = False):
     )
     render_legend()
 
-    styled = style_df_by_status(df_disp, status_col="Estatus", highlight_row=highlight_row)
-    st.dataframe(styled, use_container_width=True, hide_index=True)
+    # El Styler se evalúa al serializar en st.dataframe, por eso se mide junto con él.
+    with cronometro("styler"):
+        styled = style_df_by_status(df_disp, status_col="Estatus", highlight_row=highlight_row)
+        st.dataframe(styled, use_container_width=True, hide_index=True, column_config=TABLA_COLUMN_CONFIG)
+
+def render_panel_tiempos(muestras: list[tuple[str, float]], total_ms: float):
+    with st.expander("Tiempos de este rerun", expanded=False):
+        st.caption(f"Rerun completo: {total_ms:,.0f} ms · las secciones anidadas se traslapan (render_table incluye styler).")
+        if muestras:
+            st.dataframe(resumen_rerun(muestras), use_container_width=True, hide_index=True)
+        if st.toggle("Percentiles por sección", key="metricas_pct"):
+            horas = st.selectbox("Ventana", [1, 24, 168], index=1, format_func=lambda h: f"Últimas {h} h", key="metricas_horas")
+            st.dataframe(percentiles_metricas(horas), use_container_width=True, hide_index=True)
+
+    with st.expander("SQL (lentas / repetidas)", expanded=False):
+        log = sql_log()
+        # El switch es global (todas las sesiones): el widget refleja el estado del proceso en cada rerun y solo
+        # lo escribe cuando esta sesión lo cambia, así una sesión con el switch viejo no pisa a las demás.
+        st.session_state["sql_log_activo"] = log.activo
+        st.toggle(
+            "Registrar sentencias SQL (todas las sesiones)",
+            key="sql_log_activo",
+            on_change=lambda: setattr(log, "activo", st.session_state["sql_log_activo"]),
+            help="Aplica a todo el proceso, no solo a esta sesión; agrega un poco de costo por sentencia.",
+        )
+        if not log.activo:
+            st.caption("El registro está apagado.")
+            return
+        st.caption(f"Alertas: ≥{SQL_LENTA_MS} ms, o la misma sentencia {SQL_REPETIDA_N}+ veces en un rerun (N+1).")
+        st.markdown("**Este rerun**")
+        st.dataframe(sql_del_rerun(), use_container_width=True, hide_index=True)
+        st.markdown("**Alertas recientes**")
+        st.dataframe(log.alertas(), use_container_width=True, hide_index=True)
+
+def render_tabla_paginada(q: MaterialesQuery, key: str, compact: bool, highlight_row: bool = False):
+    total = count_materiales(q)
+    if not total:
+        st.info("No hay registros.")
+        return
+    offset = paginador(total, key)
+    df_page, _ = query_materiales(q.pagina(PAGE_SIZE, offset))
+    render_table(df_page, compact=compact, highlight_row=highlight_row)
 
-def seguimiento_update_block(df_scope: pd.DataFrame):
+@st.fragment
+def seguimiento_update_block(q_scope: MaterialesQuery):
+    # Fragmento: elegir material o escribir no re-ejecuta tabla, KPIs ni gráficas; solo un guardado exitoso refresca todo.
     st.markdown(
         f"""
 <div class="card">
@@ -816,13 +651,17 @@ def seguimiento_update_block(df_scope: pd.DataFrame):
         unsafe_allow_html=True,
     )
 
-    if df_scope.empty:
+    ids = material_ids(q_scope)
+    if not ids:
         st.info("No hay materiales para actualizar en este alcance.")
         return
 
-    id_material = st.selectbox("Material", df_scope["ID_Material"].tolist())
+    id_material = st.selectbox("Material", ids)
 
-    row = df_scope[df_scope["ID_Material"] == id_material].iloc[0]
+    row = read_material(id_material)
+    if row is None:
+        st.info("El material ya no existe.")
+        return
     estatus_actual = row["Estatus"]
 
     st.markdown(
@@ -862,14 +701,13 @@ def seguimiento_update_block(df_scope: pd.DataFrame):
 
                 if ok:
                     st.success(f"Estatus actualizado a: {nuevo_estatus}")
-                    st.rerun()
+                    metricas_buffer().vaciar()
+                    st.rerun(scope="app")
                 else:
                     st.error("No se pudo actualizar.")
 
     with b2:
-        if st.button("Ver historial", use_container_width=True):
-            df_h = df_read_historial(id_material)
-            st.dataframe(df_h, use_container_width=True, hide_index=True)
+        st.button("Ver historial", use_container_width=True, on_click=_abrir_historial, args=(id_material,))
 
     with b3:
         if st.button("Ver archivos", use_container_width=True):
@@ -878,101 +716,248 @@ def seguimiento_update_block(df_scope: pd.DataFrame):
                 st.info("Sin archivos.")
             else:
                 st.dataframe(df_a[["Version","Nombre_Original","Fecha_Subida","Subido_Por","Size_Bytes"]], use_container_width=True, hide_index=True)
+                render_galeria_archivos(df_a)
                 latest = df_a.iloc[0]
                 p = FILES_DIR / latest["Nombre_Almacenado"]
                 if p.exists():
                     st.download_button(
                         "Descargar última versión",
-                        data=p.read_bytes(),
+                        data=p.read_bytes,
                         file_name=latest["Nombre_Original"],
                         mime=latest["Mime"] or "application/octet-stream",
+                        on_click="ignore",
                         use_container_width=True
                     )
 
-def kanban_view(df: pd.DataFrame):
-    if df.empty:
+    if st.session_state.get("hist_material") == id_material:
+        render_historial(HistorialQuery(id_material=id_material), key="hist_mat")
+
+def _abrir_historial(id_material: str):
+    st.session_state.hist_material = None if st.session_state.get("hist_material") == id_material else id_material
+
+HISTORIAL_PAGE = 50
+
+def _historial_nav(key: str, cursor: Optional[tuple[str, str]]):
+    # Pila de cursores keyset: push = página más antigua, pop (cursor None) = regresar a la más reciente.
+    pila = st.session_state[f"{key}_cursores"]
+    if cursor is None:
+        pila.pop()
+    else:
+        pila.append(cursor)
+
+def render_historial(q: HistorialQuery, key: str):
+    pila = st.session_state.setdefault(f"{key}_cursores", [])
+    if st.session_state.get(f"{key}_q") != q:
+        # Otros filtros: los cursores guardados ya no aplican.
+        st.session_state[f"{key}_q"] = q
+        pila.clear()
+
+    df_h, siguiente = historial_pagina(replace(q, despues_de=pila[-1] if pila else None), HISTORIAL_PAGE)
+    if df_h.empty:
+        st.info("Sin eventos.")
+        return
+    st.dataframe(df_h, use_container_width=True, hide_index=True)
+
+    inicio = len(pila) * HISTORIAL_PAGE
+    c1, c2, c3 = st.columns([1, 2, 1])
+    c1.button("← Más recientes", key=f"{key}_prev", disabled=not pila, on_click=_historial_nav, args=(key, None), use_container_width=True)
+    c2.caption(f"Página {len(pila) + 1} · eventos {inicio + 1}–{inicio + len(df_h)}")
+    c3.button("Más antiguos →", key=f"{key}_next", disabled=siguiente is None, on_click=_historial_nav, args=(key, siguiente), use_container_width=True)
+
+JOB_POLL_S = 2
+
+def render_jobs(tipos: tuple[str, ...]):
+    jobs = listar_jobs(st.session_state.user, tipos)
+    if not jobs:
+        return
+    activos = any(j["Estado"] in JOB_ACTIVOS for j in jobs)
+    # Solo se sondea (run_every) mientras haya algo corriendo.
+    st.fragment(_panel_jobs, run_every=JOB_POLL_S if activos else None)(tipos, activos)
+
+def _panel_jobs(tipos: tuple[str, ...], habia_activos: bool):
+    jobs = listar_jobs(st.session_state.user, tipos)
+    st.markdown(
+        "<div class='card'><div class='card-title'>Trabajos en segundo plano</div>"
+        "<div class='card-sub'>Siguen corriendo aunque cambies de sección o refresques la página.</div></div>",
+        unsafe_allow_html=True,
+    )
+    for j in jobs:
+        _, etiqueta, nombre = JOB_TIPOS[j["Tipo"]]
+        if j["Estado"] in JOB_ACTIVOS:
+            st.progress(min(float(j["Progreso"] or 0), 1.0), text=f"{etiqueta} · {j['Mensaje']}")
+        elif j["Estado"] == "COMPLETO":
+            st.success(f"{etiqueta}: {j['Mensaje']}")
+            p = JOBS_DIR / j["Resultado"] if j["Resultado"] else None
+            if p is not None and p.exists():
+                st.download_button(
+                    f"Descargar {nombre}",
+                    data=p.read_bytes,
+                    file_name=f"{Path(nombre).stem}_{(j['Fecha_Fin'] or '')[:10]}{Path(nombre).suffix}",
+                    key=f"job_dl_{j['ID_Job']}",
+                    on_click="ignore",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                )
+        else:
+            st.error(f"{etiqueta}: {j['Mensaje']}")
+            st.button("Reintentar", key=f"job_retry_{j['ID_Job']}", on_click=reintentar_job, args=(j["ID_Job"],))
+
+    if habia_activos and not any(j["Estado"] in JOB_ACTIVOS for j in jobs):
+        # Terminó: un rerun completo muestra los datos nuevos y apaga el sondeo.
+        metricas_buffer().vaciar()
+        st.rerun(scope="app")
+
+ARCHIVOS_GALERIA = 12
+
+def render_galeria_archivos(df_a: pd.DataFrame):
+    # Miniaturas de las últimas versiones y vista previa de la más reciente; el original solo viaja al descargarlo.
+    # Las vistas previas las genera un job al subir el archivo; mientras no existan, no se muestran.
+    previews = []
+    for _, r in df_a.head(ARCHIVOS_GALERIA).iterrows():
+        pv = preview_paths(r["Sha256"], r["Nombre_Original"]) if pd.notna(r.get("Sha256")) else None
+        if pv and pv[0].exists() and pv[1].exists():
+            previews.append((r, pv))
+    if not previews:
+        return
+
+    cols = st.columns(3)
+    for i, (r, (thumb, _)) in enumerate(previews):
+        cols[i % 3].image(str(thumb), caption=f"v{r['Version']} · {r['Nombre_Original']}")
+
+    r, (_, preview) = previews[0]
+    st.image(str(preview), caption=f"Vista previa v{r['Version']}", use_container_width=True)
+
+KANBAN_PAGE = 10
+
+@cronometrado("kanban_view")
+def kanban_view(q: MaterialesQuery):
+    if not count_materiales(q):
         st.info("No hay registros para mostrar.")
         return
 
     # filtros rápidos
     c1, c2 = st.columns([1.2, 1])
     with c1:
-        q = st.text_input("Buscar en Kanban", placeholder="ID / Solicitud / Descripción / Item")
+        texto = st.text_input("Buscar en Kanban", placeholder="ID / Solicitud / Descripción / Item")
     with c2:
         pr = st.multiselect("Prioridad", ["Alta","Media","Baja"], default=["Alta","Media","Baja"], key="kanban_pri")
 
-    dfx = df.copy()
-    dfx = dfx[dfx["Prioridad"].isin(pr)].copy()
-    if q.strip():
-        ql = q.strip().lower()
-        dfx = dfx[
-            dfx["ID_Material"].astype(str).str.lower().str.contains(ql)
-            | dfx["ID_Solicitud"].astype(str).str.lower().str.contains(ql)
-            | dfx["Descripcion"].astype(str).str.lower().str.contains(ql)
-            | dfx["Item"].astype(str).str.lower().str.contains(ql)
-        ].copy()
+    qx = replace(q, prioridad=tuple(pr), orden=(("Prioridad", True), ("Fecha_Solicitud", False)))
+    qx = qx.buscar(texto, ["ID_Material", "ID_Solicitud", "Descripcion", "Item"])
+    kanban_board(qx)
+
+@st.fragment
+def kanban_board(qx: MaterialesQuery):
+    # Fragmento: mover tarjetas o paginar columnas no vuelve a correr el resto de la página.
+    visibles = []
+    for status in STATUS:
+        n = st.session_state.get(f"kb_n_{status}", KANBAN_PAGE)
+        visibles += material_ids(replace(qx, estatus=(status,)).pagina(n))
+
+    kanban_move_form(visibles)
 
+    counts = conteo_por_estatus(qx)
     cols = st.columns(len(STATUS))
-    for i, status in enumerate(STATUS):
-        col = cols[i]
-        d = STATUS_COLOR[status]
-        col.markdown(
-            f"""
+    for col, status in zip(cols, STATUS):
+        with col:
+            kanban_column(qx, status, counts[status])
+
+def _kanban_mover():
+    ids = st.session_state.get("kb_ids", [])
+    comment = st.session_state.get("kb_comment", "").strip()
+    move_to = st.session_state.get("kb_to", STATUS[0])
+    if not ids:
+        st.session_state["kb_flash"] = ("error", "Selecciona al menos una tarjeta.")
+        return
+    if not comment:
+        st.session_state["kb_flash"] = ("error", "Comentario obligatorio.")
+        return
+
+    res = aplicar_transiciones(
+        [{"ID_Material": i, "Estatus": move_to, "Comentario": comment} for i in ids],
+        st.session_state.user,
+        st.session_state.rol,
+    )
+    fallidos = [r for r in res if not r["ok"]]
+    if fallidos:
+        st.session_state["kb_flash"] = ("error", "No se pudo actualizar: " + ", ".join(f"{r['ID_Material']} ({r['error']})" for r in fallidos))
+    else:
+        st.session_state["kb_flash"] = ("success", f"{len(res)} tarjeta(s) movidas a: {move_to}")
+    st.session_state["kb_ids"] = []
+    st.session_state["kb_comment"] = ""
+
+def kanban_move_form(visibles: list[str]):
+    # El callback corre antes del rerun del fragmento, así el tablero ya se pinta con los estatus nuevos.
+    flash = st.session_state.pop("kb_flash", None)
+    if flash:
+        (st.success if flash[0] == "success" else st.error)(flash[1])
+
+    if any(i not in visibles for i in st.session_state.get("kb_ids", [])):
+        st.session_state["kb_ids"] = [i for i in st.session_state["kb_ids"] if i in visibles]
+
+    with st.form("kanban_move", border=False):
+        c1, c2, c3, c4 = st.columns([1.4, 1, 1.4, 0.6])
+        with c1:
+            st.multiselect("Tarjetas", visibles, key="kb_ids", placeholder="Selecciona una o varias")
+        with c2:
+            st.selectbox("Mover a", STATUS, key="kb_to")
+        with c3:
+            st.text_input("Comentario", key="kb_comment", placeholder="Motivo del cambio")
+        with c4:
+            st.form_submit_button("Aplicar", on_click=_kanban_mover, use_container_width=True)
+
+def _kanban_mas(key: str):
+    st.session_state[key] = st.session_state.get(key, KANBAN_PAGE) + KANBAN_PAGE
+
+def kanban_card_html(id_material: str, prioridad: str, descripcion, id_solicitud: str, linea: str, item) -> str:
+    descripcion, item = str(descripcion)[:85], str(item)[:20]
+    return HTML_CACHE.get(
+        ("card", id_material, prioridad, descripcion, id_solicitud, linea, item),
+        lambda: (
+            f'<div class="card" style="padding:12px 12px;margin-top:10px;">'
+            f'<div style="display:flex;justify-content:space-between;gap:10px;">'
+            f'<div style="font-weight:900;color:{BOSCH_BLUE};">{id_material}</div>'
+            f'<div style="font-weight:800;color:#333;">{prioridad}</div></div>'
+            f'<div style="margin-top:6px;font-weight:800;color:#2d2d2d;">{descripcion}</div>'
+            f'<div class="smallhelp" style="margin-top:6px;">Solicitud: <b>{id_solicitud}</b><br/>'
+            f'Línea: <b>{linea}</b> · Item: <b>{item}</b></div></div>'
+        ),
+    )
+
+@st.fragment
+def kanban_column(qx: MaterialesQuery, status: str, total: int):
+    d = STATUS_COLOR[status]
+    st.markdown(
+        f"""
 <div class="card" style="border-left:8px solid {d['fg']}; background: linear-gradient(135deg, {d['bg']}, #ffffff);">
   <div class="card-title">{status}</div>
-  <div class="card-sub"><b>{int((dfx["Estatus"]==status).sum())}</b> items</div>
+  <div class="card-sub"><b>{total}</b> items</div>
 </div>
 """,
-            unsafe_allow_html=True,
-        )
+        unsafe_allow_html=True,
+    )
+    if not total:
+        return
 
-        items = dfx[dfx["Estatus"] == status].sort_values(["Prioridad","Fecha_Solicitud"], ascending=[True, False]).head(25)
-
-        for _, r in items.iterrows():
-            col.markdown(
-                f"""
-<div class="card" style="padding:12px 12px;margin-top:10px;">
-  <div style="display:flex;justify-content:space-between;gap:10px;">
-    <div style="font-weight:900;color:{BOSCH_BLUE};">{r["ID_Material"]}</div>
-    <div style="font-weight:800;color:#333;">{r["Prioridad"]}</div>
-  </div>
-  <div style="margin-top:6px;font-weight:800;color:#2d2d2d;">{str(r["Descripcion"])[:85]}</div>
-  <div class="smallhelp" style="margin-top:6px;">
-    Solicitud: <b>{r["ID_Solicitud"]}</b><br/>
-    Línea: <b>{r["Linea"]}</b> · Item: <b>{str(r["Item"])[:20]}</b>
-  </div>
-</div>
-""",
-                unsafe_allow_html=True,
-            )
+    key = f"kb_n_{status}"
+    n = st.session_state.get(key, KANBAN_PAGE)
+    items, _ = query_materiales(replace(qx, estatus=(status,)).pagina(n))
 
-            move_to = col.selectbox("Mover a", STATUS, index=STATUS.index(status), key=f"mv_{r['ID_Material']}")
-            comment = col.text_input("Comentario", placeholder="Motivo del cambio", key=f"cm_{r['ID_Material']}")
-            if col.button("Aplicar", key=f"ap_{r['ID_Material']}"):
-                if not comment.strip():
-                    col.error("Comentario obligatorio.")
-                else:
-                    ok = update_estatus_material(
-                        id_material=r["ID_Material"],
-                        nuevo_estatus=move_to,
-                        comentario=comment.strip(),
-                        usuario=st.session_state.user,
-                        rol=st.session_state.rol
-                    )
-                    if ok:
-                        col.success("Actualizado.")
-                        st.rerun()
-                    else:
-                        col.error("No se pudo actualizar.")
+    # Toda la página de la columna en un solo markdown: un elemento en vez de uno por tarjeta.
+    cards = items[["ID_Material", "Prioridad", "Descripcion", "ID_Solicitud", "Linea", "Item"]].itertuples(index=False, name=None)
+    st.markdown("".join(kanban_card_html(*c) for c in cards), unsafe_allow_html=True)
+
+    if n < total:
+        # Solo esta columna se vuelve a pintar; el selector de tarjetas toma las nuevas en el siguiente rerun del tablero.
+        st.button(f"Cargar más ({total - n})", key=f"kb_more_{status}", on_click=_kanban_mas, args=(key,), use_container_width=True)
 
-def charts_dashboard(df: pd.DataFrame):
+@cronometrado("charts_dashboard")
+def charts_dashboard(df: pd.DataFrame, weekly: pd.DataFrame):
     if df.empty:
         st.info("No hay datos.")
         return
 
     dfx = df.copy()
-    dfx["Fecha_Solicitud"] = pd.to_datetime(dfx["Fecha_Solicitud"], errors="coerce")
-    dfx["Semana_ISO"] = dfx["Fecha_Solicitud"].apply(iso_week)
 
     c1, c2 = st.columns(2)
     with c1:
@@ -980,8 +965,7 @@ def charts_dashboard(df: pd.DataFrame):
         st.plotly_chart(fig1, use_container_width=True)
 
     with c2:
-        weekly = dfx[dfx["Semana_ISO"].notna()].groupby(["Semana_ISO","Estatus"]).size().reset_index(name="Cantidad")
-        fig2 = px.bar(weekly, x="Semana_ISO", y="Cantidad", color="Estatus", title="Conteo semanal por estatus (ISO)")
+        fig2 = px.bar(weekly, x="Semana_ISO", y="Cantidad", color="Estatus", title="Estatus al cierre de cada semana (ISO)")
         st.plotly_chart(fig2, use_container_width=True)
 
     st.markdown("<div class='card'><div class='card-title'>Pendientes por practicante</div></div>", unsafe_allow_html=True)
@@ -997,8 +981,7 @@ with st.sidebar:
 
     if st.session_state.rol == "practicante":
         lineas_usuario = LINEAS_POR_PRACTICANTE.get(st.session_state.responsable, [])
-        df_my = df_materiales[df_materiales["Linea"].isin(lineas_usuario)].copy() if len(df_materiales) else pd.DataFrame()
-        pendientes = int((df_my["Estatus"] != "Alta finalizada").sum()) if len(df_my) else 0
+        pendientes = count_materiales(MaterialesQuery(lineas=tuple(lineas_usuario), excluir_estatus=("Alta finalizada",)))
 
         st.markdown(
             f"""
@@ -1024,8 +1007,7 @@ if opcion == "Mis pendientes":
     st.markdown(f"## Mis pendientes · {st.session_state.responsable}")
 
     lineas_usuario = LINEAS_POR_PRACTICANTE.get(st.session_state.responsable, [])
-    df_my = df_materiales[df_materiales["Linea"].isin(lineas_usuario)].copy() if len(df_materiales) else pd.DataFrame()
-    df_pend = df_my[df_my["Estatus"] != "Alta finalizada"].copy() if len(df_my) else pd.DataFrame()
+    q_pend = MaterialesQuery(lineas=tuple(lineas_usuario), excluir_estatus=("Alta finalizada",))
 
     f1, f2, f3 = st.columns([1, 1, 1.2])
     with f1:
@@ -1035,26 +1017,28 @@ if opcion == "Mis pendientes":
     with f3:
         q = st.text_input("Buscar", placeholder="ID / Item / Descripción / Estación")
 
-    if not df_pend.empty:
-        df_f = df_pend[df_pend["Prioridad"].isin(pr) & df_pend["Estatus"].isin(stt)].copy()
-        if q.strip():
-            ql = q.strip().lower()
-            df_f = df_f[
-                df_f["ID_Material"].astype(str).str.lower().str.contains(ql)
-                | df_f["ID_Solicitud"].astype(str).str.lower().str.contains(ql)
-                | df_f["Item"].astype(str).str.lower().str.contains(ql)
-                | df_f["Descripcion"].astype(str).str.lower().str.contains(ql)
-                | df_f["Estacion"].astype(str).str.lower().str.contains(ql)
-            ].copy()
-
-        kpi_row(df_f)
-        render_table(df_f.sort_values(["Prioridad","Fecha_Solicitud"], ascending=[True, False]), compact=False, highlight_row=False)
-
-        exp = df_f.copy()
-        exp["Semana_ISO"] = exp["Fecha_Solicitud"].apply(iso_week)
+    if count_materiales(q_pend):
+        q_f = replace(
+            q_pend,
+            prioridad=tuple(pr),
+            estatus=tuple(stt),
+            orden=(("Prioridad", True), ("Fecha_Solicitud", False)),
+        ).buscar(q, ["ID_Material", "ID_Solicitud", "Item", "Descripcion", "Estacion"])
+
+        kpi_row(conteo_por_estatus(q_f))
+        render_tabla_paginada(q_f, key="pag_pendientes", compact=False, highlight_row=False)
+
+        def _export_pendientes():
+            sql, params = q_f.sql()
+            exp = read_sql(sql, tuple(params))
+            exp["Semana_ISO"] = exp["Fecha_Solicitud"].apply(iso_week)
+            return {"Mis_Pendientes": exp}
+
+        cache = export_cache()
         st.download_button(
             "Descargar mis pendientes (Excel)",
-            data=excel_bytes_from_dfs({"Mis_Pendientes": exp}),
+            data=lambda: export_payload(cache, "mis_pendientes", (q_f,), _export_pendientes),
+            on_click="ignore",
             file_name=f"mis_pendientes_{st.session_state.responsable}_{date.today().isoformat()}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True,
@@ -1071,10 +1055,10 @@ if opcion == "Seguimiento (BETA)":
     st.markdown("## Seguimiento (BETA)")
 
     lineas_usuario = LINEAS_POR_PRACTICANTE.get(st.session_state.responsable, [])
-    df_scope = df_materiales[df_materiales["Linea"].isin(lineas_usuario)].copy() if len(df_materiales) else pd.DataFrame()
+    q_scope = MaterialesQuery(lineas=tuple(lineas_usuario))
 
-    if not df_scope.empty:
-        kpi_row(df_scope)
+    if count_materiales(q_scope):
+        kpi_row(conteo_por_estatus(q_scope))
 
     c1, c2, c3 = st.columns([1, 1, 1.2])
     with c1:
@@ -1084,27 +1068,21 @@ if opcion == "Seguimiento (BETA)":
     with c3:
         b = st.text_input("Buscar", placeholder="SOL-... / descripción...")
 
-    df_f = df_scope.copy()
-    if linea != "Todas":
-        df_f = df_f[df_f["Linea"] == linea]
-    if estatus != "Todos":
-        df_f = df_f[df_f["Estatus"] == estatus]
-    if b.strip():
-        bl = b.strip().lower()
-        df_f = df_f[
-            df_f["ID_Solicitud"].astype(str).str.lower().str.contains(bl)
-            | df_f["Descripcion"].astype(str).str.lower().str.contains(bl)
-        ].copy()
+    q_f = replace(
+        q_scope,
+        linea=linea if linea != "Todas" else None,
+        estatus=(estatus,) if estatus != "Todos" else None,
+    ).buscar(b, ["ID_Solicitud", "Descripcion"])
 
     view = st.radio("Vista", ["Tabla", "Kanban"], horizontal=True)
 
     if view == "Tabla":
-        render_table(df_f.sort_values(["Fecha_Solicitud"], ascending=False), compact=True, highlight_row=False)
+        render_tabla_paginada(q_f, key="pag_seguimiento_beta", compact=True, highlight_row=False)
     else:
-        kanban_view(df_f)
+        kanban_view(q_f)
 
     st.markdown("---")
-    seguimiento_update_block(df_scope)
+    seguimiento_update_block(q_scope)
 
 # ---------------------------
 # NUEVA SOLICITUD (Practicante + Jefa)
@@ -1112,6 +1090,7 @@ if opcion == "Seguimiento (BETA)":
 if opcion == "Nueva solicitud":
     if st.session_state.rol not in ["practicante", "jefa"]:
         st.error("Acceso denegado.")
+        cerrar_rerun()
         st.stop()
 
     st.markdown("## Nueva solicitud")
@@ -1170,21 +1149,8 @@ if opcion == "Nueva solicitud":
             registros = []
             errors_all = []
             for m in mats:
-                rec = dict(m)
+                rec = nuevo_registro(m, id_sol)
                 rec["Comentario_Solicitud"] = comentario_general
-                rec["ID_Solicitud"] = id_sol
-                rec["ID_Material"] = generar_id_material()
-                rec["Fecha_Solicitud"] = now_iso()
-                rec["Estatus"] = "En revisión de ingeniería"
-                rec["Practicante_Asignado"] = assign_practicante(rec["Linea"])
-                rec["Comentario_Estatus"] = ""
-                rec["Material_SAP"] = ""
-                rec["InfoRecord_SAP"] = ""
-                rec["Fecha_Revision"] = None
-                rec["Fecha_Cotizacion"] = None
-                rec["Fecha_Alta_SAP"] = None
-                rec["Fecha_InfoRecord"] = None
-                rec["Fecha_Finalizada"] = None
 
                 errs = validate_record(rec)
                 if errs:
@@ -1198,13 +1164,10 @@ if opcion == "Nueva solicitud":
                     st.write(f"{mid} → " + "; ".join(errs))
 
             if registros:
-                insert_materiales(registros)
-                for r in registros:
-                    write_historial_event(r["ID_Material"], "CREADO", r["Estatus"], "Solicitud creada", st.session_state.user, st.session_state.rol)
-                    if r.get("Archivo") is not None:
-                        guardar_archivo_versionado(r["Archivo"], r["ID_Material"], st.session_state.user)
+                ingest_solicitud(registros, st.session_state.user, st.session_state.rol, "Solicitud creada")
 
                 st.success(f"Solicitud {id_sol} guardada con {len(registros)} materiales.")
+                cerrar_rerun()
                 st.rerun()
 
     with tabs[1]:
@@ -1217,79 +1180,50 @@ if opcion == "Nueva solicitud":
 """,
             unsafe_allow_html=True,
         )
+        cache = export_cache()
         st.download_button(
             "Descargar template (Critical Evaluation)",
-            data=template_excel_bytes(),
+            data=lambda: export_payload(cache, "template", (), template_sheets),
+            on_click="ignore",
             file_name="Template_Carga_Masiva_Bosch.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
         )
         up_xlsx = st.file_uploader("Subir Excel de carga masiva", type=["xlsx"])
         if up_xlsx is not None:
-            try:
-                xls = pd.ExcelFile(up_xlsx)
-                if "Template" not in xls.sheet_names:
-                    st.error("El Excel debe contener la hoja 'Template' del archivo descargado.")
-                else:
-                    df_up = pd.read_excel(xls, "Template").dropna(how="all")
-                    if df_up.empty:
-                        st.warning("El archivo no contiene filas.")
-                    else:
-                        required_cols = [
-                            "Ingeniero","Linea","Prioridad","Comentario_Solicitud",
-                            "Item","Descripcion","Estacion","Categoria","Frecuencia_Cambio",
-                            "Cant_Stock_Requerida","Cant_Equipos","Cant_Partes_Equipo","RP_Sugerido","Manufacturer"
-                        ]
-                        missing = [c for c in required_cols if c not in df_up.columns]
-                        if missing:
-                            st.error("Faltan columnas: " + ", ".join(missing))
-                        else:
-                            df_up["Ingeniero"] = df_up["Ingeniero"].fillna(ingeniero)
-                            df_up["Linea"] = df_up["Linea"].fillna(linea_sel)
-                            df_up["Prioridad"] = df_up["Prioridad"].fillna(prioridad_sel)
-
-                            id_sol = generar_id_solicitud()
-                            registros = []
-                            errors_all = []
-                            for _, row in df_up.iterrows():
-                                rec = row.to_dict()
-                                rec["ID_Solicitud"] = id_sol
-                                rec["ID_Material"] = generar_id_material()
-                                rec["Fecha_Solicitud"] = now_iso()
-                                rec["Estatus"] = "En revisión de ingeniería"
-                                rec["Practicante_Asignado"] = assign_practicante(str(rec.get("Linea","")))
-                                rec["Comentario_Estatus"] = ""
-                                rec["Material_SAP"] = ""
-                                rec["InfoRecord_SAP"] = ""
-                                rec["Fecha_Revision"] = None
-                                rec["Fecha_Cotizacion"] = None
-                                rec["Fecha_Alta_SAP"] = None
-                                rec["Fecha_InfoRecord"] = None
-                                rec["Fecha_Finalizada"] = None
-
-                                errs = validate_record(rec)
-                                if errs:
-                                    errors_all.append((rec["ID_Material"], errs, str(rec.get("Descripcion",""))[:60]))
-                                else:
-                                    registros.append(rec)
-
-                            if errors_all:
-                                st.error("Errores detectados (revisa estos registros):")
-                                for mid, errs, d in errors_all[:40]:
-                                    st.write(f"{mid} · {d} → " + "; ".join(errs))
-                                if len(errors_all) > 40:
-                                    st.caption(f"… y {len(errors_all)-40} más.")
-
-                            if registros:
-                                insert_materiales(registros)
-                                for r in registros:
-                                    write_historial_event(r["ID_Material"], "CREADO", r["Estatus"], "Solicitud masiva creada", st.session_state.user, st.session_state.rol)
-                                st.success(f"Solicitud masiva {id_sol} guardada con {len(registros)} materiales.")
-                                st.rerun()
-
-            except Exception as e:
-                st.error("No se pudo leer el archivo. Verifica el formato.")
-                st.caption(str(e))
+            id_imp = file_sha256(up_xlsx)
+            previa = leer_importacion(id_imp)
+
+            if previa and previa["Estado"] == "COMPLETA":
+                st.info(
+                    f"Este archivo ya se importó ({previa['Fecha_Fin']}): solicitud {previa['ID_Solicitud']}, "
+                    f"{previa['Insertadas']} materiales, {previa['Rechazadas']} rechazados."
+                )
+            else:
+                if previa:
+                    st.warning(f"Importación incompleta: {previa['Filas_Procesadas']} filas ya procesadas. Se continuará desde ahí.")
+                label = "Reanudar importación" if previa else "Importar"
+                if st.button(label, use_container_width=True):
+                    # El job lee el archivo desde disco: la sesión puede irse y la importación sigue.
+                    ruta = JOBS_DIR / f"import_{id_imp}.xlsx"
+                    if not ruta.exists():
+                        up_xlsx.seek(0)
+                        ruta.write_bytes(up_xlsx.getbuffer())
+                    encolar_job(
+                        "importacion",
+                        {
+                            "ruta": str(ruta),
+                            "id_importacion": id_imp,
+                            "nombre": up_xlsx.name,
+                            "defaults": {"Ingeniero": ingeniero, "Linea": linea_sel, "Prioridad": prioridad_sel},
+                            "usuario": st.session_state.user,
+                            "rol": st.session_state.rol,
+                        },
+                        st.session_state.user,
+                        llave=f"importacion:{id_imp}",
+                    )
+
+        render_jobs(("importacion",))
 
 # ---------------------------
 # JEFA/ADMIN: DASHBOARD + CHARTS + EXPORTS
@@ -1298,27 +1232,44 @@ if opcion == "Dashboard ejecutivo":
     require_role(["jefa"])
     st.markdown("## Dashboard ejecutivo")
 
+    df_materiales = df_read_materiales()
+
     if df_materiales.empty:
         st.info("Aún no hay datos.")
     else:
-        kpi_row(df_materiales)
-        charts_dashboard(df_materiales)
+        kpi_row(conteo_por_estatus(MaterialesQuery()))
 
-        df_trend = df_materiales.copy()
-        df_trend["Semana_ISO"] = df_trend["Fecha_Solicitud"].apply(iso_week)
-        trend = df_trend.groupby(["Semana_ISO","Estatus"], dropna=False).size().reset_index(name="Cantidad")
-        trend = trend[trend["Semana_ISO"].notna()].copy()
+        # Estatus reconstruido desde historial: cómo estaba el pipeline al cierre de cada semana, no el estatus actual.
+        trend = conteo_semanal()
+        charts_dashboard(df_materiales, trend)
 
         st.markdown(
             f"""
 <div class="card">
   <div class="card-title">{svg_icon("chart")} Conteo por semana (ISO)</div>
-  <div class="card-sub">Comparación semanal (ej. semana 15 vs 16 vs 17).</div>
+  <div class="card-sub">Estatus de todos los materiales al cierre de cada semana (ej. semana 15 vs 16 vs 17).</div>
 </div>
 """,
             unsafe_allow_html=True,
         )
-        st.dataframe(trend.sort_values(["Semana_ISO","Estatus"]), use_container_width=True, hide_index=True)
+        st.dataframe(
+            trend.pivot_table(index="Semana_ISO", columns="Estatus", values="Cantidad", fill_value=0)
+                 .reindex(columns=[s for s in STATUS if s in set(trend["Estatus"])])
+                 .sort_index(),
+            use_container_width=True,
+        )
+
+        semanas = sorted(trend["Semana_ISO"].unique().tolist())
+        if len(semanas) >= 2:
+            st.markdown("<div class='card'><div class='card-title'>Comparar semanas</div><div class='card-sub'>Materiales que cambiaron de estatus entre dos cierres.</div></div>", unsafe_allow_html=True)
+            c1, c2 = st.columns(2)
+            with c1:
+                sem_a = st.selectbox("Semana A", semanas, index=len(semanas) - 2)
+            with c2:
+                sem_b = st.selectbox("Semana B", semanas, index=len(semanas) - 1)
+            cambios = diff_semanas(sem_a, sem_b)
+            st.caption(f"{len(cambios)} materiales con estatus distinto entre {sem_a} y {sem_b}.")
+            st.dataframe(cambios, use_container_width=True, hide_index=True)
 
         st.markdown("---")
         st.markdown(
@@ -1331,41 +1282,60 @@ if opcion == "Dashboard ejecutivo":
             unsafe_allow_html=True,
         )
 
-        df_h = df_read_historial()
-        conn = db()
-        df_a = pd.read_sql_query("SELECT * FROM archivos", conn)
-        conn.close()
-        if len(df_a) and "Fecha_Subida" in df_a.columns:
-            df_a["Fecha_Subida"] = safe_to_datetime(df_a["Fecha_Subida"])
-
-        all_bytes = excel_bytes_from_dfs({
-            "Materiales": df_materiales.copy(),
-            "Historial": df_h.copy(),
-            "Archivos": df_a.copy(),
-            "Semanal": trend.copy(),
-        })
-
+        if st.button("Generar reporte completo (Excel)", use_container_width=True):
+            encolar_job(
+                "reporte_completo", {}, st.session_state.user,
+                llave=f"reporte_completo:{st.session_state.user}:{read_data_version()}",
+            )
+        render_jobs(("reporte_completo",))
+
+        cache = export_cache()
+
+        st.markdown("<div class='card'><div class='card-title'>Historial de cambios</div><div class='card-sub'>Auditoría por usuario, rol, estatus y fechas; la descarga incluye todos los eventos del filtro.</div></div>", unsafe_allow_html=True)
+        h1, h2, h3, h4 = st.columns([1, 1, 1.2, 1.4])
+        with h1:
+            h_usuario = st.text_input("Usuario", key="hist_usuario")
+        with h2:
+            h_rol = st.selectbox("Rol", ["Todos", "practicante", "jefa"], key="hist_rol")
+        with h3:
+            h_estatus = st.selectbox("Estatus nuevo", ["Todos"] + HISTORIAL_ESTATUS, key="hist_estatus")
+        with h4:
+            h_rango = st.date_input("Rango", value=(date.today() - timedelta(days=30), date.today()), key="hist_rango")
+        # Mientras se elige el rango, date_input regresa una sola fecha.
+        h_desde, h_hasta = (h_rango[0], h_rango[-1]) if isinstance(h_rango, tuple) and h_rango else (None, None)
+        q_hist = HistorialQuery(
+            usuario=h_usuario.strip() or None,
+            rol=h_rol if h_rol != "Todos" else None,
+            estatus=h_estatus if h_estatus != "Todos" else None,
+            desde=h_desde.isoformat() if h_desde else None,
+            hasta=(h_hasta + timedelta(days=1)).isoformat() if h_hasta else None,
+        )
+        render_historial(q_hist, key="hist_dash")
         st.download_button(
-            "Descargar reporte completo (Excel)",
-            data=all_bytes,
-            file_name=f"Bosch_Material_Management_Reporte_{date.today().isoformat()}.xlsx",
+            "Descargar historial filtrado (Excel)",
+            data=lambda: export_payload(cache, "historial", (q_hist,), lambda: {"Historial": q_hist.sql()}),
+            on_click="ignore",
+            file_name=f"Historial_{date.today().isoformat()}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
         )
 
-        st.markdown("<div class='card'><div class='card-title'>Snapshot por semana</div><div class='card-sub'>Selecciona semana ISO y descarga el corte.</div></div>", unsafe_allow_html=True)
-        weeks = sorted([w for w in df_trend["Semana_ISO"].dropna().unique().tolist()])
+        st.markdown("<div class='card'><div class='card-title'>Snapshot por semana</div><div class='card-sub'>Cortes congelados al cierre de cada semana ISO; la semana en curso se congela al cerrar.</div></div>", unsafe_allow_html=True)
+        if snapshot_scheduler().ultimo_error:
+            st.warning(f"No se pudo congelar la última semana: {snapshot_scheduler().ultimo_error}")
+        snaps = snapshots_congelados()
+        weeks = snaps["Semana"].tolist()
         sel_week = st.selectbox("Semana", weeks if weeks else ["—"])
 
         if weeks:
-            snap = df_trend[df_trend["Semana_ISO"] == sel_week].copy()
-            snap_ids = snap["ID_Material"].unique().tolist()
-            df_hs = df_h[df_h["ID_Material"].isin(snap_ids)].copy()
-
+            info = snaps[snaps["Semana"] == sel_week].iloc[0]
+            st.caption(f"{info['Materiales']} materiales · {info['Eventos']} eventos · congelado {info['Fecha_Congelado'].replace('T', ' ')}")
+            # El snapshot no cambia: la llave del cache no depende de la versión de datos.
             st.download_button(
                 f"Descargar snapshot {sel_week} (Excel)",
-                data=excel_bytes_from_dfs({"Materiales": snap, "Historial": df_hs}),
-                file_name=f"Snapshot_{sel_week}_{date.today().isoformat()}.xlsx",
+                data=lambda: export_payload(cache, "snapshot", (sel_week,), lambda: snapshot_sheets(sel_week), version=0),
+                on_click="ignore",
+                file_name=f"Snapshot_{sel_week}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
             )
@@ -1377,10 +1347,10 @@ if opcion == "Seguimiento":
     require_role(["jefa"])
     st.markdown("## Seguimiento")
 
-    if df_materiales.empty:
+    if not count_materiales(MaterialesQuery()):
         st.info("No hay datos.")
     else:
-        kpi_row(df_materiales)
+        kpi_row(conteo_por_estatus(MaterialesQuery()))
 
         c1, c2, c3, c4 = st.columns([1, 1, 1, 1.2])
         with c1:
@@ -1392,36 +1362,36 @@ if opcion == "Seguimiento":
         with c4:
             q = st.text_input("Buscar", placeholder="ID / solicitud / descripción")
 
-        df_f = df_materiales.copy()
-        if linea != "Todas":
-            df_f = df_f[df_f["Linea"] == linea]
-        if pract != "Todos":
-            df_f = df_f[df_f["Practicante_Asignado"] == pract]
-        if est != "Todos":
-            df_f = df_f[df_f["Estatus"] == est]
-        if q.strip():
-            ql = q.strip().lower()
-            df_f = df_f[
-                df_f["ID_Material"].astype(str).str.lower().str.contains(ql)
-                | df_f["ID_Solicitud"].astype(str).str.lower().str.contains(ql)
-                | df_f["Descripcion"].astype(str).str.lower().str.contains(ql)
-                | df_f["Item"].astype(str).str.lower().str.contains(ql)
-            ].copy()
+        q_f = MaterialesQuery(
+            linea=linea if linea != "Todas" else None,
+            practicante=pract if pract != "Todos" else None,
+            estatus=(est,) if est != "Todos" else None,
+        ).buscar(q, ["ID_Material", "ID_Solicitud", "Descripcion", "Item"])
 
         view = st.radio("Vista", ["Tabla", "Kanban"], horizontal=True, key="view_jefa")
 
         if view == "Tabla":
-            render_table(df_f.sort_values(["Fecha_Solicitud"], ascending=False), compact=True, highlight_row=False)
+            render_tabla_paginada(q_f, key="pag_seguimiento_jefa", compact=True, highlight_row=False)
         else:
-            kanban_view(df_f)
+            kanban_view(q_f)
 
         st.markdown("---")
-        seguimiento_update_block(df_f)
+        seguimiento_update_block(q_f)
 
+        cache = export_cache()
         st.download_button(
             "Descargar vista filtrada (Excel)",
-            data=excel_bytes_from_dfs({"Seguimiento_Filtrado": df_f.copy()}),
+            data=lambda: export_payload(cache, "seguimiento_filtrado", (q_f,), lambda: {"Seguimiento_Filtrado": q_f.sql()}),
+            on_click="ignore",
             file_name=f"seguimiento_filtrado_{date.today().isoformat()}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True,
         )
+
+# ---------------------------
+# TIEMPOS DEL RERUN (solo jefa)
+# ---------------------------
+RERUN_MS = cerrar_rerun()
+if st.session_state.rol == "jefa":
+    with st.sidebar:
+        render_panel_tiempos(MUESTRAS_RERUN, RERUN_MS)
@@ -0,0 +1,218 @@
+# bench_datos.py — benchmarks de la capa de datos (sin Streamlit)
+# --------------------------------------------------------------
+# Para cada tamaño crea una base sintética desechable (benchmarks/sintetico.py) y mide las operaciones
+# que más pesan en la app: lectura del frame de materiales, cadenas de filtros + conteos, búsqueda FTS,
+# altas, cambios de estatus, export a Excel y la agregación semanal. Reporta mediana / mínimo en ms y el
+# pico de memoria Python (tracemalloc) de cada operación, más el RSS máximo del proceso.
+#
+#   python benchmarks/bench_datos.py                         # 10k y 100k
+#   python benchmarks/bench_datos.py 10k 100k 1m --json out.json
+#   python benchmarks/bench_datos.py 100k --base out.json    # falla (exit 1) si algo es >25% más lento
+#
+# Cada tamaño corre en su propio subproceso: base, caches y RSS no se mezclan entre tamaños.
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import replace
+from datetime import date
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sintetico import generar, parse_filas
+
+REPETICIONES = 5
+LOTE_ALTA = 1000
+LOTE_TRANSICIONES = 500
+UPDATES_SUELTOS = 100
+EXCEL_MAX_FILAS = 50000
+TOLERANCIA = 0.25
+
+def medir(nombre: str, fn: Callable[[], object], repeticiones: int = REPETICIONES, preparar: Optional[Callable[[], None]] = None) -> dict:
+    """Corre fn `repeticiones` veces (tiempos) y una vez más bajo tracemalloc (pico de memoria)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    # tracemalloc encarece cada asignación, por eso la memoria se mide en una corrida aparte.
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    try:
+        fn()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "op": nombre,
+        "mediana_ms": round(statistics.median(tiempos), 2),
+        "min_ms": round(min(tiempos), 2),
+        "pico_mb": round(pico / 2**20, 2),
+    }
+
+def correr_tamano(n: int, semanas: int) -> dict:
+    """Siembra n materiales en la base del entorno y mide todas las operaciones. Corre dentro del subproceso."""
+    import datos
+
+    seed = generar(n, semanas)
+
+    def frio():
+        # Sin cache de lectura: mide SQL + parseo, como el primer rerun después de una escritura.
+        datos._df_read_materiales_cached.cache_clear()
+        datos._read_sql_cached.cache_clear()
+
+    # La misma consulta que arma "Mis pendientes" en app.py con los filtros por default (líneas del practicante).
+    lineas_practicante = next(iter(datos.LINEAS_POR_PRACTICANTE.values()))
+    q_pendientes = replace(
+        datos.MaterialesQuery(lineas=tuple(lineas_practicante), excluir_estatus=("Alta finalizada",)),
+        prioridad=("Alta", "Media", "Baja"),
+        estatus=tuple(datos.STATUS),
+        orden=(("Prioridad", True), ("Fecha_Solicitud", False)),
+    ).buscar("", ["ID_Material", "ID_Solicitud", "Item", "Descripcion", "Estacion"])
+    q_seguimiento = datos.MaterialesQuery(
+        lineas=tuple(datos.LINEAS[:6]), estatus=tuple(datos.STATUS[:4]), prioridad=("Alta", "Media"),
+    )
+    q_busqueda = datos.MaterialesQuery().buscar("valvula festo", ["ID_Material", "Item", "Descripcion"])
+    semana_actual = datos.iso_week(date.today())
+    semana_a = datos.semana_siguiente(semana_actual, -(semanas // 2))
+    semana_b = datos.semana_siguiente(semana_actual, -1)
+
+    def pagina_con_conteos(q):
+        datos.query_materiales(q.pagina(50))
+        datos.conteo_por_estatus(q)
+
+    def alta_lote():
+        base = {"Ingeniero": "Bench", "Linea": datos.LINEAS[0], "Prioridad": "Media", "Descripcion": "Sensor bench"}
+        datos.insert_materiales([datos.nuevo_registro(base, "SOL-BENCH") for _ in range(LOTE_ALTA)])
+
+    def ingest_lote():
+        base = {"Ingeniero": "Bench", "Linea": datos.LINEAS[1], "Prioridad": "Alta", "Descripcion": "Válvula bench"}
+        datos.ingest_solicitud([datos.nuevo_registro(base, "SOL-BENCH") for _ in range(LOTE_ALTA)], "bench", "practicante", "Alta bench")
+
+    ids = datos.material_ids(datos.MaterialesQuery(estatus=(datos.STATUS[0],)).pagina(LOTE_TRANSICIONES))
+
+    def updates_sueltos():
+        for id_material in ids[:UPDATES_SUELTOS]:
+            datos.update_estatus_material(id_material, datos.STATUS[1], "bench", "bench", "practicante")
+
+    def transiciones_lote():
+        datos.aplicar_transiciones(
+            [{"ID_Material": i, "Estatus": datos.STATUS[2], "Comentario": "bench"} for i in ids], "bench", "practicante",
+        )
+
+    def excel():
+        datos.excel_bytes_from_dfs({
+            "Materiales": ("SELECT * FROM materiales LIMIT ?", [EXCEL_MAX_FILAS]),
+            "Historial": ("SELECT * FROM historial ORDER BY Fecha_Evento DESC LIMIT ?", [EXCEL_MAX_FILAS]),
+            "Semanal": datos.conteo_semanal(),
+        })
+
+    def sin_checkpoints():
+        conn = datos.db()
+        with conn:
+            for tabla in ("estatus_cambios", "checkpoint_semanas", "conteo_cierre"):
+                conn.execute(f"DELETE FROM {tabla}")
+        conn.close()
+        frio()
+
+    resultados = [
+        medir("df_read_materiales (frío)", datos.df_read_materiales, preparar=frio),
+        medir("df_read_materiales (cache)", datos.df_read_materiales),
+        medir("filtro pendientes + conteos", lambda: pagina_con_conteos(q_pendientes), preparar=frio),
+        medir("filtro seguimiento + conteos", lambda: pagina_con_conteos(q_seguimiento), preparar=frio),
+        medir("búsqueda FTS + conteos", lambda: pagina_con_conteos(q_busqueda), preparar=frio),
+        medir("filtro seguimiento sin página", lambda: datos.query_materiales(q_seguimiento), preparar=frio),
+        medir("extender_checkpoints (desde cero)", datos.extender_checkpoints, repeticiones=1, preparar=sin_checkpoints),
+        medir("conteo_semanal", datos.conteo_semanal, preparar=frio),
+        medir("estatus_semana", lambda: datos.estatus_semana(semana_a), preparar=frio),
+        medir("diff_semanas", lambda: datos.diff_semanas(semana_a, semana_b), preparar=frio),
+        medir(f"excel_bytes_from_dfs (≤{EXCEL_MAX_FILAS} filas/hoja)", excel, repeticiones=1, preparar=frio),
+        medir(f"insert_materiales ({LOTE_ALTA})", alta_lote, repeticiones=3),
+        medir(f"ingest_solicitud ({LOTE_ALTA})", ingest_lote, repeticiones=3),
+        medir(f"update_estatus_material x{UPDATES_SUELTOS}", updates_sueltos, repeticiones=1),
+        medir(f"aplicar_transiciones ({len(ids)})", transiciones_lote, repeticiones=3),
+    ]
+    return {
+        "filas": n,
+        "historial": seed["historial"],
+        "siembra_s": round(seed["segundos"], 1),
+        "db_mb": round(datos.DB_PATH.stat().st_size / 2**20, 1),
+        # Linux reporta ru_maxrss en KiB.
+        "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "ops": resultados,
+    }
+
+def lanzar(n: int, semanas: int) -> dict:
+    """Corre un tamaño en un subproceso con su propia base temporal y regresa su resultado."""
+    tmp = Path(tempfile.mkdtemp(prefix=f"bench_{n}_"))
+    try:
+        env = dict(os.environ, BOSCH_DB_PATH=str(tmp / "bench.sqlite"), BOSCH_FILES_DIR=str(tmp / "archivos"))
+        out = subprocess.run(
+            [sys.executable, __file__, "--tamano", str(n), "--semanas", str(semanas)],
+            env=env, check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def imprimir(res: dict, base: Optional[dict]) -> list[str]:
+    """Tabla de un tamaño; regresa las operaciones que empeoraron más de TOLERANCIA contra la base."""
+    previas = {op["op"]: op for op in (base or {}).get("ops", [])}
+    regresiones = []
+    print(
+        f"\n== {res['filas']:,} materiales · {res['historial']:,} eventos · siembra {res['siembra_s']}s · "
+        f"base {res['db_mb']} MB · RSS máx {res['rss_max_mb']} MB"
+    )
+    print(f"{'operación':<42} {'mediana ms':>11} {'mín ms':>10} {'pico MB':>9} {'vs base':>9}")
+    for op in res["ops"]:
+        delta = ""
+        prev = previas.get(op["op"])
+        if prev and prev["mediana_ms"] > 0:
+            cambio = op["mediana_ms"] / prev["mediana_ms"] - 1
+            delta = f"{cambio:+.0%}"
+            if cambio > TOLERANCIA:
+                regresiones.append(f"{res['filas']}: {op['op']} {prev['mediana_ms']} -> {op['mediana_ms']} ms")
+                delta += " !"
+        print(f"{op['op']:<42} {op['mediana_ms']:>11.2f} {op['min_ms']:>10.2f} {op['pico_mb']:>9.2f} {delta:>9}")
+    return regresiones
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmarks de la capa de datos sobre bases sintéticas.")
+    ap.add_argument("filas", nargs="*", default=["10k", "100k"], help="tamaños a medir: 10k, 100k, 1m…")
+    ap.add_argument("--semanas", type=int, default=12, help="semanas de historial sintético")
+    ap.add_argument("--json", help="guarda los resultados para compararlos después con --base")
+    ap.add_argument("--base", help="resultados previos (--json); exit 1 si una operación empeora más de 25%%")
+    ap.add_argument("--tamano", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.tamano:
+        print(json.dumps(correr_tamano(args.tamano, args.semanas)))
+        return
+
+    base = {r["filas"]: r for r in json.loads(Path(args.base).read_text())} if args.base else {}
+    resultados, regresiones = [], []
+    for n in map(parse_filas, args.filas):
+        res = lanzar(n, args.semanas)
+        resultados.append(res)
+        regresiones += imprimir(res, base.get(n))
+    if args.json:
+        Path(args.json).write_text(json.dumps(resultados, indent=2, ensure_ascii=False))
+    if regresiones:
+        print("\nRegresiones (>25% más lento que la base):\n  " + "\n  ".join(regresiones))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# sintetico.py — datos sintéticos para benchmarks y pruebas de carga
+# --------------------------------------------------------------
+# Llena una base desechable con N materiales y su historial (CREADO + avances de estatus repartidos en
+# las últimas semanas), con la misma forma que dejan la UI y la importación masiva. Es determinista por seed.
+#
+#   python benchmarks/sintetico.py 100k --db /tmp/bosch_100k.sqlite
+#
+# Para abrir la app contra esa base: BOSCH_DB_PATH=/tmp/bosch_100k.sqlite streamlit run app.py
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SEED_CHUNK = 20000
+
+PIEZAS = ["Válvula", "Sensor", "Cilindro", "Rodamiento", "Fusible", "Relevador", "Boquilla", "Banda", "Motor", "Filtro"]
+MARCAS = ["Festo", "SMC", "Omron", "Siemens", "SKF", "Balluff", "Sick", "Pilz"]
+ESTACIONES = ["OP10", "OP20", "OP30", "OP40", "OP50", "EOL", "Prensa", "Soldadura"]
+PRIORIDADES = ["Alta", "Media", "Baja"]
+USUARIOS = ["Ing. Demo", "Jefa", "Jarol", "Lalo", "Jime", "Niko"]
+
+def parse_filas(texto: str) -> int:
+    """ "10k" / "100k" / "1m" / "2500" -> número de filas."""
+    t = texto.strip().lower()
+    mult = {"k": 1000, "m": 1000000}.get(t[-1:], 1)
+    return int(float(t[:-1] if mult > 1 else t) * mult)
+
+def _material(rng: random.Random, i: int, inicio: datetime, ahora: datetime, status: list, fecha_map: dict, lineas: dict):
+    """Regresa (params del INSERT de materiales, eventos de historial) para el material i."""
+    practicante = rng.choice(list(lineas))
+    linea = rng.choice(lineas[practicante])
+    id_material = f"MAT-{i:08X}"
+    fecha = inicio + timedelta(seconds=rng.randrange(int((ahora - inicio).total_seconds())))
+
+    # Avanza hasta un estatus al azar; cada paso entre 0 y 5 días después del anterior, sin pasar de hoy.
+    destino = rng.randrange(len(status))
+    eventos = [(f"EVT-{i:08X}-0", id_material, fecha.isoformat(timespec="seconds"), "Ing. Demo", "practicante", "CREADO", status[0], "Alta de solicitud")]
+    fechas = {}
+    t = fecha
+    for paso in range(1, destino + 1):
+        t = min(t + timedelta(hours=rng.randrange(0, 120)), ahora)
+        f = t.isoformat(timespec="seconds")
+        fechas[fecha_map[status[paso]]] = f
+        eventos.append((f"EVT-{i:08X}-{paso}", id_material, f, rng.choice(USUARIOS), "practicante", status[paso - 1], status[paso], ""))
+
+    pieza = rng.choice(PIEZAS)
+    marca = rng.choice(MARCAS)
+    params = (
+        id_material, f"SOL-{fecha.strftime('%Y%m%d-%H%M%S')}", fecha.isoformat(timespec="seconds"), "Ing. Demo", linea,
+        rng.choice(PRIORIDADES), "", f"{marca[:3].upper()}-{rng.randrange(100000):05d}",
+        f"{pieza} {marca} {rng.randrange(10, 999)}", rng.choice(ESTACIONES), rng.choice(["MAZE", "FHMI", "HIBE"]), "Mensual",
+        float(rng.randrange(1, 20)), rng.randrange(1, 6), rng.randrange(1, 4), "", marca,
+        status[destino], practicante, "", "", "",
+        fechas.get("Fecha_Revision"), fechas.get("Fecha_Cotizacion"), fechas.get("Fecha_Alta_SAP"),
+        fechas.get("Fecha_InfoRecord"), fechas.get("Fecha_Finalizada"),
+    )
+    return params, eventos
+
+def generar(n: int, semanas: int = 12, seed: int = 17, ahora: Optional[datetime] = None) -> dict:
+    """Inserta n materiales con historial en la base de datos.DB_PATH (ya migrada). Regresa conteos y segundos."""
+    # datos lee BOSCH_DB_PATH al importarse: se importa hasta que el llamador ya fijó el entorno.
+    import datos
+
+    datos.init_db()
+    rng = random.Random(seed)
+    ahora = (ahora or datetime.now()).replace(microsecond=0)
+    inicio = ahora - timedelta(weeks=semanas)
+    n_eventos = 0
+    t0 = time.perf_counter()
+    conn = datos.db()
+    try:
+        for desde in range(0, n, SEED_CHUNK):
+            mats, eventos = [], []
+            for i in range(desde, min(desde + SEED_CHUNK, n)):
+                m, e = _material(rng, i, inicio, ahora, datos.STATUS, datos.FECHA_MAP, datos.LINEAS_POR_PRACTICANTE)
+                mats.append(m)
+                eventos.extend(e)
+            with conn:
+                conn.executemany(datos.INSERT_MATERIAL_SQL, mats)
+                conn.executemany(datos.INSERT_HISTORIAL_SQL, eventos)
+            n_eventos += len(eventos)
+        with conn:
+            datos.bump_data_version(conn.cursor())
+    finally:
+        conn.close()
+    return {"materiales": n, "historial": n_eventos, "segundos": time.perf_counter() - t0}
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Genera una base sintética de materiales + historial.")
+    ap.add_argument("filas", help="materiales a generar: 10k, 100k, 1m…")
+    ap.add_argument("--db", required=True, help="ruta de la base SQLite a crear (no debe existir)")
+    ap.add_argument("--archivos", help="carpeta de adjuntos/jobs (default: junto a la base)")
+    ap.add_argument("--semanas", type=int, default=12)
+    ap.add_argument("--seed", type=int, default=17)
+    args = ap.parse_args()
+
+    db_path = Path(args.db).resolve()
+    if db_path.exists():
+        ap.error(f"{db_path} ya existe; usa una ruta nueva para no mezclar datos.")
+    os.environ["BOSCH_DB_PATH"] = str(db_path)
+    os.environ["BOSCH_FILES_DIR"] = str(Path(args.archivos).resolve() if args.archivos else db_path.with_suffix(".archivos"))
+    res = generar(parse_filas(args.filas), args.semanas, args.seed)
+    print(f"{res['materiales']} materiales, {res['historial']} eventos en {res['segundos']:.1f}s -> {db_path}")
+
+if __name__ == "__main__":
+    main()
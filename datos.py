@@ -0,0 +1,2483 @@
+# datos.py — capa de datos de Bosch Material Management (sin Streamlit)
+# --------------------------------------------------------------
+# SQLite (pool + migraciones), consultas, escrituras con historial, adjuntos, checkpoints y snapshots semanales,
+# exports a Excel, importación masiva y jobs. app.py solo arma la UI encima de esto; los benchmarks
+# (benchmarks/) lo importan directo, apuntando BOSCH_DB_PATH / BOSCH_FILES_DIR a una base desechable.
+
+import pandas as pd
+import sqlite3
+from datetime import datetime, date, timedelta
+from pathlib import Path
+import uuid
+import re
+import queue
+import os
+import tempfile
+import hashlib
+import json
+import functools
+import atexit
+import logging
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Union
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from dataclasses import dataclass, replace
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# ---------------------------
+# CACHES DE PROCESO
+# ---------------------------
+# El módulo vive en sys.modules mientras dure el proceso, así que estos caches sobreviven a los reruns de app.py
+# igual que st.cache_resource / st.cache_data, sin depender de Streamlit.
+def _por_proceso(fn: Callable):
+    """Recurso único por proceso: la primera llamada lo crea (bajo lock), las demás lo reutilizan."""
+    lock = threading.Lock()
+    creado = []
+
+    @functools.wraps(fn)
+    def wrapper():
+        if not creado:
+            with lock:
+                if not creado:
+                    creado.append(fn())
+        return creado[0]
+    return wrapper
+
+def _cache_por_version(max_entries: int):
+    """Memoiza un lector de DataFrames por sus argumentos (el último es la versión de datos).
+
+    Cada llamada recibe una copia superficial: con copy-on-write, modificarla no toca el frame en cache.
+    """
+    def deco(fn: Callable[..., pd.DataFrame]):
+        cached = functools.lru_cache(maxsize=max_entries)(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args) -> pd.DataFrame:
+            return cached(*args).copy(deep=False)
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return deco
+
+# ---------------------------
+# MÉTRICAS (tiempos por sección)
+# ---------------------------
+# Cada sección cronometrada deja una muestra en la lista del rerun en curso (si la UI abrió una) y en un buffer
+# del proceso que se vuelca a la tabla metricas por lotes. Los workers de jobs no tienen rerun: solo van al buffer.
+METRICAS_FLUSH_N = 200
+METRICAS_FLUSH_S = 30
+METRICAS_BUFFER_MAX = 20000
+METRICAS_RETENCION_DIAS = 14
+
+_muestras_rerun: ContextVar[Optional[list]] = ContextVar("muestras_rerun", default=None)
+# Sentencias del rerun en curso: SQL normalizado -> [veces, ms acumulados] (lo llena el log de SQL si está activo).
+_sql_rerun: ContextVar[Optional[dict]] = ContextVar("sql_rerun", default=None)
+
+class MetricasBuffer:
+    """Muestras (fecha, sección, ms) pendientes de escribir; acotado, si nadie vacía se pierden las más viejas."""
+
+    def __init__(self, max_items: int):
+        self._items: "deque[tuple[str, str, float]]" = deque(maxlen=max_items)
+        self._lock = threading.Lock()
+        self._ultimo = time.monotonic()
+
+    def agregar(self, seccion: str, ms: float) -> None:
+        with self._lock:
+            self._items.append((now_iso(), seccion, ms))
+
+    def vaciar(self, forzar: bool = False) -> int:
+        """Escribe las muestras en un solo INSERT por lote si ya toca (N muestras o S segundos) o si `forzar`."""
+        with self._lock:
+            if not self._items or not (forzar or len(self._items) >= METRICAS_FLUSH_N or time.monotonic() - self._ultimo >= METRICAS_FLUSH_S):
+                return 0
+            filas = list(self._items)
+            self._items.clear()
+            self._ultimo = time.monotonic()
+        corte = (datetime.now() - timedelta(days=METRICAS_RETENCION_DIAS)).isoformat(timespec="seconds")
+        conn = db()
+        with conn:
+            conn.executemany("INSERT INTO metricas (Fecha, Seccion, Ms) VALUES (?, ?, ?)", filas)
+            conn.execute("DELETE FROM metricas WHERE Fecha < ?", (corte,))
+        conn.close()
+        return len(filas)
+
+@_por_proceso
+def metricas_buffer() -> MetricasBuffer:
+    buf = MetricasBuffer(METRICAS_BUFFER_MAX)
+    # Lo que no alcanzó el umbral de N muestras / S segundos se escribe al salir el proceso.
+    atexit.register(buf.vaciar, True)
+    return buf
+
+@contextmanager
+def cronometro(seccion: str):
+    """Mide el bloque y registra la muestra en el rerun en curso y en el buffer del proceso."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        muestras = _muestras_rerun.get()
+        if muestras is not None:
+            muestras.append((seccion, ms))
+        metricas_buffer().agregar(seccion, ms)
+
+def cronometrado(seccion: str):
+    """Decorador de cronometro(): cada llamada a la función cuenta como una muestra de `seccion`."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with cronometro(seccion):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def iniciar_rerun() -> list[tuple[str, float]]:
+    """Abre la lista de muestras del rerun actual (la llena todo lo cronometrado en este hilo)."""
+    muestras: list[tuple[str, float]] = []
+    _muestras_rerun.set(muestras)
+    _sql_rerun.set({})
+    return muestras
+
+def resumen_rerun(muestras: list[tuple[str, float]]) -> pd.DataFrame:
+    """Sección, Llamadas, Total_ms, Max_ms de las muestras de un rerun, de la más cara a la más barata."""
+    df = pd.DataFrame(muestras, columns=["Seccion", "Ms"])
+    return (
+        df.groupby("Seccion")["Ms"].agg(Llamadas="count", Total_ms="sum", Max_ms="max")
+        .round(1).sort_values("Total_ms", ascending=False).reset_index()
+    )
+
+# Percentiles por rango (nearest-rank) sin traer las muestras a memoria: el primer Ms cuyo rango alcanza p·n.
+PERCENTILES_SQL = """
+    WITH r AS (
+        SELECT Seccion, Ms,
+               ROW_NUMBER() OVER (PARTITION BY Seccion ORDER BY Ms) AS i,
+               COUNT(*) OVER (PARTITION BY Seccion) AS n
+        FROM metricas WHERE Fecha >= ?
+    )
+    SELECT Seccion, MAX(n) AS Muestras,
+           MIN(CASE WHEN i >= 0.50 * n THEN Ms END) AS P50_ms,
+           MIN(CASE WHEN i >= 0.90 * n THEN Ms END) AS P90_ms,
+           MIN(CASE WHEN i >= 0.99 * n THEN Ms END) AS P99_ms,
+           MAX(Ms) AS Max_ms
+    FROM r GROUP BY Seccion ORDER BY P90_ms DESC
+"""
+
+def percentiles_metricas(horas: int = 24) -> pd.DataFrame:
+    """p50 / p90 / p99 / máx por sección en las últimas `horas` (vacía primero lo pendiente del buffer)."""
+    metricas_buffer().vaciar(forzar=True)
+    desde = (datetime.now() - timedelta(hours=horas)).isoformat(timespec="seconds")
+    return read_sql(PERCENTILES_SQL, (desde,)).round(1)
+
+# ---------------------------
+# CONSTANTS
+# ---------------------------
+APP_DIR = Path(__file__).parent
+# Se pueden redirigir por entorno (benchmarks, pruebas locales) sin tocar la base de producción.
+DB_PATH = Path(os.environ.get("BOSCH_DB_PATH") or APP_DIR / "bd_materiales.sqlite")
+FILES_DIR = Path(os.environ.get("BOSCH_FILES_DIR") or APP_DIR / "archivos_materiales")
+FILES_DIR.mkdir(parents=True, exist_ok=True)
+BLOBS_DIR = FILES_DIR / "blobs"
+PREVIEWS_DIR = FILES_DIR / "previews"
+JOBS_DIR = FILES_DIR / "jobs"
+
+CATEGORIAS_MATERIAL = ["MAZE", "FHMI", "HIBE"]
+
+STATUS = [
+    "En revisión de ingeniería",
+    "En cotización",
+    "En alta SAP",
+    "En espera de InfoRecord",
+    "Info record creado",
+    "Alta finalizada",
+]
+
+FECHA_MAP = {
+    "En revisión de ingeniería": "Fecha_Revision",
+    "En cotización": "Fecha_Cotizacion",
+    "En alta SAP": "Fecha_Alta_SAP",
+    "En espera de InfoRecord": "Fecha_InfoRecord",
+    "Info record creado": "Fecha_InfoRecord",
+    "Alta finalizada": "Fecha_Finalizada",
+}
+
+LINEAS_POR_PRACTICANTE = {
+    "Jarol": ["DP 02", "SCU 33", "SCU 34", "SCU 48", "SSL1"],
+    "Lalo": ["APA 36", "APA 38", "SERVO 10", "SERVO 24"],
+    "Jime": ["DP 32", "DP 35", "SENSOR 28", "SENSOR 5"],
+    "Niko": ["KGT 22", "KGT 23", "LG 01", "LG 03"],
+}
+LINEAS = sorted(list(set(sum(LINEAS_POR_PRACTICANTE.values(), []))))
+
+# ---------------------------
+# SQL LOG (sentencias lentas / repetidas)
+# ---------------------------
+# Opcional (BOSCH_SQL_TRACE=1 o el switch del panel de la jefa). El trace callback de sqlite3 solo entrega el
+# texto de la sentencia, sin duración ni filas, así que el registro se hace en el cursor de las conexiones del
+# pool: execute() mide el paso inicial y los fetch suman su tiempo y sus filas a la misma entrada.
+SQL_LOG_MAX = 2000
+SQL_ALERTAS_MAX = 200
+SQL_LENTA_MS = 100
+SQL_REPETIDA_N = 10
+# Funciones de plomería: el origen que se reporta es la primera función de app.py / datos.py fuera de estas.
+SQL_ORIGEN_IGNORAR = {
+    "execute", "executemany", "fetchone", "fetchmany", "fetchall", "__next__", "cursor", "_open_connection",
+    "read_sql", "_read_sql_cached", "_df_read_materiales_cached", "wrapper", "write_excel", "bump_data_version",
+}
+
+sql_logger = logging.getLogger("bosch.sql")
+
+@functools.lru_cache(maxsize=1024)
+def normalizar_sql(sql: str) -> str:
+    """Quita literales y colapsa listas IN (?, ?, …) y espacios, para agrupar la misma forma de consulta."""
+    s = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    s = re.sub(r"(?<![\w.])\d+(?:\.\d+)?\b", "?", s)
+    s = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, …)", s)
+    return " ".join(s.split())
+
+def _origen_sql() -> str:
+    f = sys._getframe(2)
+    while f is not None:
+        code = f.f_code
+        if os.path.basename(code.co_filename) in ("app.py", "datos.py") and code.co_name not in SQL_ORIGEN_IGNORAR:
+            return f"{os.path.basename(code.co_filename)}:{code.co_name}:{f.f_lineno}"
+        f = f.f_back
+    return "?"
+
+class SqlLog:
+    """Log circular de sentencias (SQL normalizado, ms, filas, origen) y de alertas por lentitud o repetición."""
+
+    def __init__(self, activo: bool):
+        self.activo = activo
+        self._log: "deque[dict]" = deque(maxlen=SQL_LOG_MAX)
+        self._alertas: "deque[dict]" = deque(maxlen=SQL_ALERTAS_MAX)
+        self._lock = threading.Lock()
+
+    def registrar(self, sql: str, ms: float, filas: int) -> dict:
+        entrada = {"Fecha": now_iso(), "SQL": normalizar_sql(sql), "Ms": ms, "Filas": filas, "Origen": _origen_sql(), "Alerta": ""}
+        por_rerun = _sql_rerun.get()
+        with self._lock:
+            self._log.append(entrada)
+            if por_rerun is not None:
+                acum = por_rerun.setdefault(entrada["SQL"], [0, 0.0])
+                acum[0] += 1
+                acum[1] += ms
+                # Se avisa una vez, al cruzar el umbral: N+1 típico (un INSERT/SELECT por fila en un ciclo).
+                if acum[0] == SQL_REPETIDA_N:
+                    self._alertar(entrada, f"repetida {SQL_REPETIDA_N}x en el rerun")
+            if ms >= SQL_LENTA_MS:
+                self._alertar(entrada, f"lenta (≥{SQL_LENTA_MS} ms)")
+        return entrada
+
+    def sumar(self, entrada: dict, ms: float, filas: int) -> None:
+        """Agrega a la entrada el tiempo y las filas de un fetch; la marca lenta si con eso cruza el umbral."""
+        por_rerun = _sql_rerun.get()
+        with self._lock:
+            lenta_antes = entrada["Ms"] >= SQL_LENTA_MS
+            entrada["Ms"] += ms
+            entrada["Filas"] += filas
+            if por_rerun is not None and entrada["SQL"] in por_rerun:
+                por_rerun[entrada["SQL"]][1] += ms
+            if not lenta_antes and entrada["Ms"] >= SQL_LENTA_MS:
+                self._alertar(entrada, f"lenta (≥{SQL_LENTA_MS} ms)")
+
+    def _alertar(self, entrada: dict, motivo: str) -> None:
+        entrada["Alerta"] = motivo
+        self._alertas.append(entrada)
+        sql_logger.warning("SQL %s: %.1f ms, %s filas, %s: %s", motivo, entrada["Ms"], entrada["Filas"], entrada["Origen"], entrada["SQL"])
+
+    def log(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame(list(self._log), columns=["Fecha", "SQL", "Ms", "Filas", "Origen", "Alerta"]).round(1)
+
+    def alertas(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame(list(reversed(self._alertas)), columns=["Fecha", "SQL", "Ms", "Filas", "Origen", "Alerta"]).round(1)
+
+@_por_proceso
+def sql_log() -> SqlLog:
+    return SqlLog(os.environ.get("BOSCH_SQL_TRACE") == "1")
+
+def sql_del_rerun() -> pd.DataFrame:
+    """SQL, Veces, Total_ms de las sentencias del rerun actual, las más repetidas primero."""
+    filas = [(sql, n, ms) for sql, (n, ms) in (_sql_rerun.get() or {}).items()]
+    df = pd.DataFrame(filas, columns=["SQL", "Veces", "Total_ms"]).round(1)
+    return df.sort_values(["Veces", "Total_ms"], ascending=False).reset_index(drop=True)
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor que registra cada sentencia en sql_log(); solo se usa mientras el log está activo."""
+
+    _entrada: Optional[dict] = None
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._entrada = sql_log().registrar(sql, (time.perf_counter() - t0) * 1000, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._entrada = sql_log().registrar(sql, (time.perf_counter() - t0) * 1000, max(self.rowcount, 0))
+
+    def _fetch(self, fetch, *args):
+        t0 = time.perf_counter()
+        res = fetch(*args)
+        if self._entrada is not None:
+            n = len(res) if isinstance(res, list) else int(res is not None)
+            sql_log().sumar(self._entrada, (time.perf_counter() - t0) * 1000, n)
+        return res
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size: int = -1):
+        return self._fetch(super().fetchmany, self.arraysize if size == -1 else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+# ---------------------------
+# DB LAYER (SQLite)
+# ---------------------------
+DB_POOL_SIZE = 8
+
+DB_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -32000",
+    "PRAGMA temp_store = MEMORY",
+]
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión SQLite que regresa al pool en close() en lugar de cerrarse."""
+
+    _pool: Optional[queue.LifoQueue] = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        if factory is sqlite3.Cursor and sql_log().activo:
+            factory = TracedCursor
+        return super().cursor(factory)
+
+    # conn.execute() del módulo sqlite3 crea su cursor en C sin pasar por cursor(): con el log activo se desvía aquí.
+    def execute(self, sql, parameters=()):
+        if sql_log().activo:
+            return self.cursor().execute(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if sql_log().activo:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        return super().executemany(sql, seq_of_parameters)
+
+    def close(self) -> None:
+        if self.in_transaction:
+            self.rollback()
+        if self._pool is not None:
+            try:
+                self._pool.put_nowait(self)
+                return
+            except queue.Full:
+                pass
+        super().close()
+
+@_por_proceso
+def _db_pool() -> queue.LifoQueue:
+    # Un pool por proceso: sobrevive a los reruns y se comparte entre sesiones.
+    return queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def _open_connection(pool: queue.LifoQueue) -> PooledConnection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    conn._pool = pool
+    return conn
+
+def db() -> sqlite3.Connection:
+    # Toma una conexión ociosa del pool (o abre una nueva); conn.close() la devuelve.
+    pool = _db_pool()
+    try:
+        return pool.get_nowait()
+    except queue.Empty:
+        return _open_connection(pool)
+
+# Índices secundarios para los caminos de acceso de la app (historial/archivos por material, filtros de vistas).
+DB_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_historial_material_fecha ON historial (ID_Material, Fecha_Evento)",
+    "CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial (Fecha_Evento)",
+    "CREATE INDEX IF NOT EXISTS idx_archivos_material_version ON archivos (ID_Material, Version)",
+    "CREATE INDEX IF NOT EXISTS idx_materiales_linea_estatus ON materiales (Linea, Estatus)",
+    "CREATE INDEX IF NOT EXISTS idx_materiales_practicante_estatus ON materiales (Practicante_Asignado, Estatus)",
+    "CREATE INDEX IF NOT EXISTS idx_materiales_estatus ON materiales (Estatus)",
+    "CREATE INDEX IF NOT EXISTS idx_materiales_fecha ON materiales (Fecha_Solicitud)",
+]
+
+# Índice de texto completo (FTS5, contenido externo) para las cajas de búsqueda; los triggers lo mantienen
+# sincronizado con materiales. Se liga por rowid: si algún día se hace VACUUM, correr un 'rebuild' después.
+FTS_COLS = ["ID_Material", "ID_Solicitud", "Item", "Descripcion", "Estacion"]
+
+FTS_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS materiales_fts USING fts5(
+        {", ".join(FTS_COLS)},
+        content='materiales', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS materiales_fts_ai AFTER INSERT ON materiales BEGIN
+        INSERT INTO materiales_fts (rowid, {", ".join(FTS_COLS)})
+        VALUES (new.rowid, {", ".join("new." + c for c in FTS_COLS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS materiales_fts_ad AFTER DELETE ON materiales BEGIN
+        INSERT INTO materiales_fts (materiales_fts, rowid, {", ".join(FTS_COLS)})
+        VALUES ('delete', old.rowid, {", ".join("old." + c for c in FTS_COLS)});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS materiales_fts_au AFTER UPDATE OF {", ".join(FTS_COLS)} ON materiales BEGIN
+        INSERT INTO materiales_fts (materiales_fts, rowid, {", ".join(FTS_COLS)})
+        VALUES ('delete', old.rowid, {", ".join("old." + c for c in FTS_COLS)});
+        INSERT INTO materiales_fts (rowid, {", ".join(FTS_COLS)})
+        VALUES (new.rowid, {", ".join("new." + c for c in FTS_COLS)});
+    END
+    """,
+]
+
+# Migraciones de esquema, en orden: PRAGMA user_version = cuántas ya se aplicaron. Solo se agregan al final, nunca
+# se editan ni reordenan las que ya salieron. Usan IF NOT EXISTS porque las bases creadas antes del runner
+# (user_version 0) ya traen parte del esquema.
+def _m_esquema_base(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS materiales (
+            ID_Material TEXT PRIMARY KEY,
+            ID_Solicitud TEXT,
+            Fecha_Solicitud TEXT,
+            Ingeniero TEXT,
+            Linea TEXT,
+            Prioridad TEXT,
+            Comentario_Solicitud TEXT,
+            Item TEXT,
+            Descripcion TEXT,
+            Estacion TEXT,
+            Categoria TEXT,
+            Frecuencia_Cambio TEXT,
+            Cant_Stock_Requerida REAL,
+            Cant_Equipos INTEGER,
+            Cant_Partes_Equipo INTEGER,
+            RP_Sugerido TEXT,
+            Manufacturer TEXT,
+            Estatus TEXT,
+            Practicante_Asignado TEXT,
+            Comentario_Estatus TEXT,
+            Material_SAP TEXT,
+            InfoRecord_SAP TEXT,
+            Fecha_Revision TEXT,
+            Fecha_Cotizacion TEXT,
+            Fecha_Alta_SAP TEXT,
+            Fecha_InfoRecord TEXT,
+            Fecha_Finalizada TEXT
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS historial (
+            ID_Evento TEXT PRIMARY KEY,
+            ID_Material TEXT,
+            Fecha_Evento TEXT,
+            Usuario TEXT,
+            Rol TEXT,
+            Estatus_Anterior TEXT,
+            Estatus_Nuevo TEXT,
+            Comentario TEXT
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archivos (
+            ID_Archivo TEXT PRIMARY KEY,
+            ID_Material TEXT,
+            Version INTEGER,
+            Nombre_Original TEXT,
+            Nombre_Almacenado TEXT,
+            Mime TEXT,
+            Size_Bytes INTEGER,
+            Fecha_Subida TEXT,
+            Subido_Por TEXT
+        )
+        """
+    )
+
+def _m_indices(cur: sqlite3.Cursor) -> None:
+    for ddl in DB_INDEXES:
+        cur.execute(ddl)
+
+def _m_data_version(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            Clave TEXT PRIMARY KEY,
+            Valor INTEGER
+        )
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO meta (Clave, Valor) VALUES ('data_version', 0)")
+
+def _m_busqueda(cur: sqlite3.Cursor) -> None:
+    for ddl in FTS_DDL:
+        cur.execute(ddl)
+    cur.execute("INSERT INTO materiales_fts (materiales_fts) VALUES ('rebuild')")
+    cur.execute("INSERT INTO materiales_fts (materiales_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 3.0, 1.0, 1.0)')")
+
+def _m_importaciones(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS importaciones (
+            ID_Importacion TEXT PRIMARY KEY,
+            Nombre_Archivo TEXT,
+            ID_Solicitud TEXT,
+            Filas_Procesadas INTEGER,
+            Insertadas INTEGER,
+            Rechazadas INTEGER,
+            Estado TEXT,
+            Fecha_Inicio TEXT,
+            Fecha_Fin TEXT,
+            Usuario TEXT
+        )
+        """
+    )
+
+def _m_estatus_semanal(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS estatus_semanal (
+            Semana TEXT,
+            ID_Material TEXT,
+            Estatus TEXT,
+            PRIMARY KEY (Semana, ID_Material)
+        ) WITHOUT ROWID
+        """
+    )
+
+def _m_adjuntos_por_contenido(cur: sqlite3.Cursor) -> None:
+    # Adjuntos nuevos van a blobs/ por SHA-256; blobs.Refs cuenta cuántas filas de archivos apuntan a cada uno.
+    # Las filas anteriores se quedan con su Nombre_Almacenado de siempre y Sha256 NULL.
+    cur.execute("ALTER TABLE archivos ADD COLUMN Sha256 TEXT")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            Sha256 TEXT PRIMARY KEY,
+            Size_Bytes INTEGER,
+            Refs INTEGER NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_archivos_sha ON archivos (Sha256)")
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS archivos_blob_ai AFTER INSERT ON archivos WHEN new.Sha256 IS NOT NULL BEGIN
+            INSERT INTO blobs (Sha256, Size_Bytes, Refs) VALUES (new.Sha256, new.Size_Bytes, 1)
+            ON CONFLICT (Sha256) DO UPDATE SET Refs = Refs + 1;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS archivos_blob_ad AFTER DELETE ON archivos WHEN old.Sha256 IS NOT NULL BEGIN
+            UPDATE blobs SET Refs = Refs - 1 WHERE Sha256 = old.Sha256;
+        END
+        """
+    )
+
+def _m_jobs(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            ID_Job TEXT PRIMARY KEY,
+            Tipo TEXT,
+            Llave TEXT,
+            Params TEXT,
+            Estado TEXT,
+            Progreso REAL,
+            Mensaje TEXT,
+            Resultado TEXT,
+            Usuario TEXT,
+            Fecha_Creacion TEXT,
+            Fecha_Inicio TEXT,
+            Fecha_Fin TEXT,
+            Intentos INTEGER
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_usuario_fecha ON jobs (Usuario, Fecha_Creacion)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_estado_fecha ON jobs (Estado, Fecha_Creacion)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_llave ON jobs (Llave)")
+
+def _m_usuarios(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            Usuario TEXT PRIMARY KEY,
+            Pwd_Hash TEXT,
+            Rol TEXT,
+            Responsable TEXT
+        )
+        """
+    )
+
+def _m_metricas(cur: sqlite3.Cursor) -> None:
+    cur.execute("CREATE TABLE IF NOT EXISTS metricas (Fecha TEXT, Seccion TEXT, Ms REAL)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_metricas_fecha ON metricas (Fecha)")
+
+def _m_historial_keyset(cur: sqlite3.Cursor) -> None:
+    # Paginación keyset del historial: el orden (Fecha_Evento, ID_Evento) sale del índice, sin sort ni OFFSET.
+    cur.execute("DROP INDEX IF EXISTS idx_historial_fecha")
+    cur.execute("DROP INDEX IF EXISTS idx_historial_material_fecha")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_historial_fecha_evento ON historial (Fecha_Evento, ID_Evento)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_historial_material_evento ON historial (ID_Material, Fecha_Evento, ID_Evento)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_historial_usuario_evento ON historial (Usuario, Fecha_Evento, ID_Evento)")
+
+def _m_snapshots(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            Semana TEXT PRIMARY KEY,
+            Fecha_Congelado TEXT,
+            Materiales INTEGER,
+            Eventos INTEGER
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_materiales (
+            Semana TEXT,
+            ID_Material TEXT,
+            ID_Solicitud TEXT,
+            Fecha_Solicitud TEXT,
+            Ingeniero TEXT,
+            Linea TEXT,
+            Prioridad TEXT,
+            Comentario_Solicitud TEXT,
+            Item TEXT,
+            Descripcion TEXT,
+            Estacion TEXT,
+            Categoria TEXT,
+            Frecuencia_Cambio TEXT,
+            Cant_Stock_Requerida REAL,
+            Cant_Equipos INTEGER,
+            Cant_Partes_Equipo INTEGER,
+            RP_Sugerido TEXT,
+            Manufacturer TEXT,
+            Estatus TEXT,
+            Practicante_Asignado TEXT,
+            Comentario_Estatus TEXT,
+            Material_SAP TEXT,
+            InfoRecord_SAP TEXT,
+            Fecha_Revision TEXT,
+            Fecha_Cotizacion TEXT,
+            Fecha_Alta_SAP TEXT,
+            Fecha_InfoRecord TEXT,
+            Fecha_Finalizada TEXT,
+            Estatus_Cierre_Semana TEXT,
+            PRIMARY KEY (Semana, ID_Material)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_historial (
+            Semana TEXT,
+            ID_Evento TEXT,
+            ID_Material TEXT,
+            Fecha_Evento TEXT,
+            Usuario TEXT,
+            Rol TEXT,
+            Estatus_Anterior TEXT,
+            Estatus_Nuevo TEXT,
+            Comentario TEXT,
+            PRIMARY KEY (Semana, ID_Evento)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshot_conteos (
+            Semana TEXT,
+            Estatus TEXT,
+            Cantidad INTEGER,
+            PRIMARY KEY (Semana, Estatus)
+        ) WITHOUT ROWID
+        """
+    )
+    # Una semana congelada no se corrige: ni UPDATE ni DELETE sobre ninguna de las tablas.
+    for tabla in ("snapshots", "snapshot_materiales", "snapshot_historial", "snapshot_conteos"):
+        for op in ("UPDATE", "DELETE"):
+            cur.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {tabla}_no_{op.lower()} BEFORE {op} ON {tabla} "
+                f"BEGIN SELECT RAISE(ABORT, 'Los snapshots semanales son inmutables'); END"
+            )
+
+def _m_importacion_rechazos(cur: sqlite3.Cursor) -> None:
+    # Filas rechazadas de cada importación, guardadas con el bloque: el Excel de errores sobrevive a una reanudación.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS importacion_rechazos (
+            ID_Importacion TEXT,
+            Fila INTEGER,
+            Datos TEXT,
+            Errores TEXT,
+            PRIMARY KEY (ID_Importacion, Fila)
+        ) WITHOUT ROWID
+        """
+    )
+
+def _m_checkpoints_delta(cur: sqlite3.Cursor) -> None:
+    # estatus_semanal guardaba una fila por material por semana (materiales × semanas). Se reemplaza por los cambios:
+    # una fila solo en la semana en que el estatus al cierre de un material difiere del cierre anterior.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS estatus_cambios (
+            Semana TEXT,
+            ID_Material TEXT,
+            Estatus TEXT,
+            PRIMARY KEY (Semana, ID_Material)
+        ) WITHOUT ROWID
+        """
+    )
+    # Cubre la reconstrucción por material (MAX(Semana) por ID_Material) y la búsqueda del estatus anterior.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_estatus_cambios_material ON estatus_cambios (ID_Material, Semana, Estatus)")
+    cur.execute("CREATE TABLE IF NOT EXISTS checkpoint_semanas (Semana TEXT PRIMARY KEY, Cambios INTEGER)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS conteo_cierre (
+            Semana TEXT,
+            Estatus TEXT,
+            Cantidad INTEGER,
+            PRIMARY KEY (Semana, Estatus)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO estatus_cambios (Semana, ID_Material, Estatus)
+        SELECT Semana, ID_Material, Estatus FROM (
+            SELECT Semana, ID_Material, Estatus,
+                   LAG(Estatus) OVER (PARTITION BY ID_Material ORDER BY Semana) AS Anterior
+            FROM estatus_semanal
+        ) WHERE Anterior IS NOT Estatus
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO checkpoint_semanas (Semana, Cambios)
+        SELECT s.Semana, (SELECT COUNT(*) FROM estatus_cambios c WHERE c.Semana = s.Semana)
+        FROM (SELECT DISTINCT Semana FROM estatus_semanal) s
+        """
+    )
+    cur.execute("INSERT INTO conteo_cierre (Semana, Estatus, Cantidad) SELECT Semana, Estatus, COUNT(*) FROM estatus_semanal GROUP BY Semana, Estatus")
+    cur.execute("DROP TABLE estatus_semanal")
+
+MIGRACIONES: list[tuple[str, Callable[[sqlite3.Cursor], None]]] = [
+    ("esquema base", _m_esquema_base),
+    ("índices de vistas", _m_indices),
+    ("versión de datos", _m_data_version),
+    ("búsqueda FTS5", _m_busqueda),
+    ("importaciones", _m_importaciones),
+    ("checkpoints semanales", _m_estatus_semanal),
+    ("usuarios", _m_usuarios),
+    ("adjuntos por contenido", _m_adjuntos_por_contenido),
+    ("jobs en segundo plano", _m_jobs),
+    ("métricas de tiempos", _m_metricas),
+    ("historial keyset", _m_historial_keyset),
+    ("snapshots semanales", _m_snapshots),
+    ("rechazos de importación", _m_importacion_rechazos),
+    ("checkpoints por cambios", _m_checkpoints_delta),
+]
+
+def migrar() -> int:
+    """Aplica las migraciones pendientes, cada una en su propia transacción; regresa la versión final del esquema."""
+    conn = db()
+    try:
+        while True:
+            # IMMEDIATE: otro proceso que esté migrando la misma base termina antes de que leamos user_version.
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > len(MIGRACIONES):
+                raise RuntimeError(f"La base está en la versión {version} y la app solo conoce {len(MIGRACIONES)}.")
+            if version == len(MIGRACIONES):
+                conn.rollback()
+                return version
+            _, paso = MIGRACIONES[version]
+            paso(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@_por_proceso
+def init_db() -> int:
+    # Una vez por proceso: _por_proceso serializa la primera llamada y los reruns ya no tocan el esquema.
+    return migrar()
+
+# Consultas que emite la app: (sql, params de ejemplo, se permite scan completo).
+# Las lecturas completas (carga del frame, export de archivos) son scans a propósito.
+QUERY_PLAN_CHECKS = [
+    ("SELECT * FROM materiales", [], True),
+    ("SELECT * FROM archivos", [], True),
+    ("SELECT Valor FROM meta WHERE Clave = 'data_version'", [], False),
+    ("SELECT Estatus FROM materiales WHERE ID_Material = ?", ["MAT-X"], False),
+    ("SELECT * FROM historial WHERE ID_Material = ? ORDER BY Fecha_Evento DESC", ["MAT-X"], False),
+    ("SELECT * FROM historial ORDER BY Fecha_Evento DESC", [], False),
+    ("SELECT * FROM archivos WHERE ID_Material = ? ORDER BY Version DESC", ["MAT-X"], False),
+    ("SELECT 1 FROM archivos WHERE Sha256 = ? LIMIT 1", ["0" * 64], False),
+    ("SELECT * FROM materiales WHERE Linea = ? AND Estatus = ?", ["DP 02", STATUS[0]], False),
+    ("SELECT * FROM materiales WHERE Practicante_Asignado = ? AND Estatus = ?", ["Jarol", STATUS[0]], False),
+    ("SELECT * FROM materiales WHERE Estatus = ?", [STATUS[0]], False),
+    ("SELECT Seccion, Ms FROM metricas WHERE Fecha >= ?", ["2026-01-01T00:00:00"], False),
+]
+
+def check_query_plans() -> list[str]:
+    """Corre EXPLAIN QUERY PLAN sobre QUERY_PLAN_CHECKS y regresa las consultas que caen en scan de tabla."""
+    problemas = []
+    conn = db()
+    for sql, params, allow_scan in QUERY_PLAN_CHECKS:
+        if allow_scan:
+            continue
+        plan = [str(step["detail"]) for step in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # El plan nombra las tablas por su alias ("SCAN m"), así que no se compara contra sqlite_master: cualquier
+        # SCAN sin "USING ... INDEX" cuenta, salvo subconsultas/CTE que el mismo plan materializa o corre como
+        # co-rutina ("MATERIALIZE e" ... "SCAN e"), filas constantes y tablas virtuales (FTS5).
+        derivadas = {d.split(" ", 1)[1] for d in plan if d.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+        for detail in plan:
+            if not detail.startswith("SCAN "):
+                continue
+            escaneada = detail[5:].split(" ")[0]
+            if (escaneada in derivadas or escaneada.startswith("(") or " USING " in detail
+                    or "VIRTUAL TABLE" in detail or "CONSTANT ROW" in detail):
+                continue
+            problemas.append(f"{sql} -> {detail}")
+    conn.close()
+    return problemas
+
+@_por_proceso
+def verify_query_plans() -> bool:
+    # Una vez por proceso: si algún índice se pierde, la app falla al arrancar en lugar de degradarse en silencio.
+    problemas = check_query_plans()
+    if problemas:
+        raise RuntimeError("Consultas sin índice (table scan):\n" + "\n".join(problemas))
+    return True
+
+
+def bump_data_version(cur: sqlite3.Cursor) -> None:
+    # Se llama dentro de la misma transacción que la escritura: invalida los caches de lectura.
+    cur.execute("UPDATE meta SET Valor = Valor + 1 WHERE Clave = 'data_version'")
+
+def read_data_version() -> int:
+    conn = db()
+    row = conn.execute("SELECT Valor FROM meta WHERE Clave = 'data_version'").fetchone()
+    conn.close()
+    return int(row["Valor"]) if row else 0
+
+# ---------------------------
+# UTILS
+# ---------------------------
+def now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+def generar_id_solicitud() -> str:
+    return f"SOL-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+def generar_id_material() -> str:
+    return f"MAT-{uuid.uuid4().hex[:8].upper()}"
+
+def iso_week(d: Optional[pd.Timestamp]) -> Optional[str]:
+    if d is None or pd.isna(d):
+        return None
+    try:
+        y, w, _ = d.isocalendar()
+        return f"{y}-W{int(w):02d}"
+    except Exception:
+        return None
+
+def iso_week_bounds(semana: str) -> tuple[str, str]:
+    """"2026-W05" -> (lunes de esa semana, lunes siguiente) en ISO, para filtrar Fecha_* por rango en SQL."""
+    y, w = semana.split("-W")
+    lunes = date.fromisocalendar(int(y), int(w), 1)
+    return lunes.isoformat(), (lunes + timedelta(days=7)).isoformat()
+
+def safe_to_datetime(series: pd.Series) -> pd.Series:
+    return pd.to_datetime(series, errors="coerce")
+
+@_cache_por_version(4)
+def _df_read_materiales_cached(data_version: int) -> pd.DataFrame:
+    return read_sql("SELECT * FROM materiales", ())
+
+@cronometrado("df_read_materiales")
+def df_read_materiales() -> pd.DataFrame:
+    # Cache por versión de datos: los reruns reutilizan el frame parseado hasta que hay una escritura.
+    return _df_read_materiales_cached(read_data_version())
+
+@cronometrado("df_read_archivos")
+def df_read_archivos(material_id: str) -> pd.DataFrame:
+    conn = db()
+    df = pd.read_sql_query(
+        "SELECT * FROM archivos WHERE ID_Material = ? ORDER BY Version DESC",
+        conn,
+        params=[material_id],
+    )
+    conn.close()
+    if len(df) and "Fecha_Subida" in df.columns:
+        df["Fecha_Subida"] = safe_to_datetime(df["Fecha_Subida"])
+    return df
+
+# ---------------------------
+# QUERY BUILDER (filtros + paginación en SQL)
+# ---------------------------
+MATERIALES_COLS = [
+    "ID_Material", "ID_Solicitud", "Fecha_Solicitud", "Ingeniero", "Linea", "Prioridad", "Comentario_Solicitud",
+    "Item", "Descripcion", "Estacion", "Categoria", "Frecuencia_Cambio", "Cant_Stock_Requerida", "Cant_Equipos",
+    "Cant_Partes_Equipo", "RP_Sugerido", "Manufacturer", "Estatus", "Practicante_Asignado",
+    "Comentario_Estatus", "Material_SAP", "InfoRecord_SAP",
+    "Fecha_Revision", "Fecha_Cotizacion", "Fecha_Alta_SAP", "Fecha_InfoRecord", "Fecha_Finalizada",
+]
+
+@dataclass(frozen=True)
+class MaterialesQuery:
+    """Filtro de materiales para las vistas de lista; se compila a SQL parametrizado.
+
+    None en un filtro de lista significa "sin filtro"; una tupla vacía no deja pasar nada
+    (igual que un multiselect vacío).
+    """
+
+    lineas: Optional[tuple[str, ...]] = None
+    linea: Optional[str] = None
+    practicante: Optional[str] = None
+    estatus: Optional[tuple[str, ...]] = None
+    excluir_estatus: tuple[str, ...] = ()
+    prioridad: Optional[tuple[str, ...]] = None
+    busquedas: tuple[tuple[str, tuple[str, ...]], ...] = ()
+    orden: tuple[tuple[str, bool], ...] = (("Fecha_Solicitud", False),)
+    limit: Optional[int] = None
+    offset: int = 0
+
+    def buscar(self, texto: str, columnas: list[str]) -> "MaterialesQuery":
+        texto = (texto or "").strip()
+        if not texto:
+            return self
+        return replace(self, busquedas=self.busquedas + ((texto, tuple(columnas)),))
+
+    def pagina(self, limit: Optional[int], offset: int = 0) -> "MaterialesQuery":
+        return replace(self, limit=limit, offset=offset)
+
+    def fts_match(self) -> Optional[str]:
+        """Expresión MATCH de FTS5 para las búsquedas de texto (prefijo por token, AND entre tokens)."""
+        partes = []
+        for texto, columnas in self.busquedas:
+            tokens = re.findall(r"\w+", texto.lower())
+            cols = [c for c in columnas if c in FTS_COLS]
+            if not tokens or not cols:
+                continue
+            partes.append(f"{{{' '.join(cols)}}} : (" + " AND ".join(f'"{t}"*' for t in tokens) + ")")
+        return " AND ".join(partes) if partes else None
+
+    def from_where(self) -> tuple[str, list]:
+        conds, params = [], []
+
+        def _in(col: str, values: tuple[str, ...]):
+            if not values:
+                conds.append("1 = 0")
+            else:
+                conds.append(f"materiales.{col} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+
+        frm = " FROM materiales"
+        match = self.fts_match()
+        if match:
+            frm += " JOIN materiales_fts ON materiales_fts.rowid = materiales.rowid"
+            conds.append("materiales_fts MATCH ?")
+            params.append(match)
+
+        if self.lineas is not None:
+            _in("Linea", self.lineas)
+        if self.linea:
+            conds.append("materiales.Linea = ?")
+            params.append(self.linea)
+        if self.practicante:
+            conds.append("materiales.Practicante_Asignado = ?")
+            params.append(self.practicante)
+        if self.estatus is not None:
+            _in("Estatus", self.estatus)
+        if self.excluir_estatus:
+            conds.append(f"materiales.Estatus NOT IN ({','.join('?' * len(self.excluir_estatus))})")
+            params.extend(self.excluir_estatus)
+        if self.prioridad is not None:
+            _in("Prioridad", self.prioridad)
+
+        return frm + ((" WHERE " + " AND ".join(conds)) if conds else ""), params
+
+    def sql(self, select: str = "materiales.*") -> tuple[str, list]:
+        frm, params = self.from_where()
+        sql = f"SELECT {select}{frm}"
+        orden = [f"materiales.{c} {'ASC' if asc else 'DESC'}" for c, asc in self.orden if c in MATERIALES_COLS]
+        if orden and "materiales_fts" in frm:
+            # Con búsqueda de texto, primero relevancia (bm25) y luego el orden de la vista.
+            orden = ["materiales_fts.rank"] + orden
+        if orden:
+            sql += " ORDER BY " + ", ".join(orden)
+        if self.limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [int(self.limit), int(self.offset)]
+        return sql, params
+
+FECHA_COLS = ["Fecha_Solicitud", "Fecha_Revision", "Fecha_Cotizacion", "Fecha_Alta_SAP", "Fecha_InfoRecord", "Fecha_Finalizada"]
+
+def read_sql(sql: str, params: tuple) -> pd.DataFrame:
+    # Lectura y parseo de fechas por separado: en los frames grandes el parseo pesa tanto como el SQL.
+    with cronometro("db.lectura"):
+        conn = db()
+        df = pd.read_sql_query(sql, conn, params=list(params))
+        conn.close()
+    with cronometro("db.fechas"):
+        for c in FECHA_COLS:
+            if c in df.columns:
+                df[c] = safe_to_datetime(df[c])
+    return df
+
+@_cache_por_version(64)
+def _read_sql_cached(sql: str, params: tuple, data_version: int) -> pd.DataFrame:
+    return read_sql(sql, params)
+
+@cronometrado("query_materiales")
+def query_materiales(q: MaterialesQuery) -> tuple[pd.DataFrame, int]:
+    """Regresa la página pedida por q (limit/offset) y el total de registros que cumplen el filtro."""
+    version = read_data_version()
+    sql, params = q.sql()
+    df = _read_sql_cached(sql, tuple(params), version)
+    if q.limit is None:
+        return df, len(df)
+    return df, count_materiales(q)
+
+def count_materiales(q: MaterialesQuery) -> int:
+    sql, params = replace(q, orden=(), limit=None).sql("COUNT(*) AS n")
+    df = _read_sql_cached(sql, tuple(params), read_data_version())
+    return int(df["n"].iloc[0]) if len(df) else 0
+
+def conteo_por_estatus(q: MaterialesQuery) -> Dict[str, int]:
+    frm, params = q.from_where()
+    sql = f"SELECT materiales.Estatus, COUNT(*) AS n{frm} GROUP BY materiales.Estatus"
+    df = _read_sql_cached(sql, tuple(params), read_data_version())
+    counts = {s: 0 for s in STATUS}
+    for s, n in zip(df["Estatus"], df["n"]):
+        counts[s] = int(n)
+    return counts
+
+def material_ids(q: MaterialesQuery) -> list[str]:
+    sql, params = q.sql("materiales.ID_Material")
+    return _read_sql_cached(sql, tuple(params), read_data_version())["ID_Material"].tolist()
+
+# ---------------------------
+# HISTORIAL (paginación keyset)
+# ---------------------------
+HISTORIAL_ESTATUS = ["CREADO"] + STATUS
+
+@dataclass(frozen=True)
+class HistorialQuery:
+    """Filtro del historial, del evento más reciente al más viejo; `despues_de` es el cursor keyset.
+
+    `despues_de` = (Fecha_Evento, ID_Evento) del último evento de la página anterior. `desde` / `hasta`
+    son fechas ISO (hasta exclusivo). `estatus` filtra por Estatus_Nuevo.
+    """
+
+    id_material: Optional[str] = None
+    usuario: Optional[str] = None
+    rol: Optional[str] = None
+    estatus: Optional[str] = None
+    desde: Optional[str] = None
+    hasta: Optional[str] = None
+    despues_de: Optional[tuple[str, str]] = None
+
+    def sql(self, limit: Optional[int] = None) -> tuple[str, list]:
+        conds, params = [], []
+        for col, val in (("ID_Material", self.id_material), ("Usuario", self.usuario), ("Rol", self.rol), ("Estatus_Nuevo", self.estatus)):
+            if val:
+                conds.append(f"{col} = ?")
+                params.append(val)
+        if self.desde:
+            conds.append("Fecha_Evento >= ?")
+            params.append(self.desde)
+        if self.hasta:
+            conds.append("Fecha_Evento < ?")
+            params.append(self.hasta)
+        if self.despues_de:
+            # Comparación de row values: SQLite la resuelve como rango sobre el índice (Fecha_Evento, ID_Evento).
+            conds.append("(Fecha_Evento, ID_Evento) < (?, ?)")
+            params.extend(self.despues_de)
+        sql = "SELECT * FROM historial" + ((" WHERE " + " AND ".join(conds)) if conds else "")
+        sql += " ORDER BY Fecha_Evento DESC, ID_Evento DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return sql, params
+
+@cronometrado("historial_pagina")
+def historial_pagina(q: HistorialQuery, limite: int) -> tuple[pd.DataFrame, Optional[tuple[str, str]]]:
+    """Una página de `limite` eventos y el cursor de la siguiente (None si ya no hay más)."""
+    sql, params = q.sql(limite + 1)
+    conn = db()
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    siguiente = None
+    if len(df) > limite:
+        df = df.iloc[:limite]
+        siguiente = (df["Fecha_Evento"].iloc[-1], df["ID_Evento"].iloc[-1])
+    df["Fecha_Evento"] = safe_to_datetime(df["Fecha_Evento"])
+    return df, siguiente
+
+QUERY_PLAN_CHECKS.extend(
+    (sql, params, False)
+    for sql, params in [
+        HistorialQuery().sql(50),
+        HistorialQuery(despues_de=("2026-01-12T10:00:00", "EVT-X")).sql(50),
+        HistorialQuery(id_material="MAT-X", despues_de=("2026-01-12T10:00:00", "EVT-X")).sql(50),
+        HistorialQuery(usuario="jarol", desde="2026-01-01", hasta="2026-02-01").sql(50),
+        HistorialQuery(rol="jefa", estatus=STATUS[1], desde="2026-01-01", hasta="2026-02-01").sql(),
+    ]
+)
+
+def read_material(id_material: str) -> Optional[dict]:
+    conn = db()
+    row = conn.execute("SELECT * FROM materiales WHERE ID_Material = ?", (id_material,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+# Formas de consulta de las vistas de lista (se revisan con EXPLAIN QUERY PLAN al arrancar).
+QUERY_PLAN_CHECKS.extend(
+    (sql, params, False)
+    for sql, params in [
+        MaterialesQuery(lineas=("DP 02", "SCU 33"), excluir_estatus=("Alta finalizada",),
+                        orden=(("Prioridad", True), ("Fecha_Solicitud", False))).pagina(50).sql(),
+        MaterialesQuery(practicante="Jarol", estatus=(STATUS[0],)).pagina(50).sql(),
+        MaterialesQuery(estatus=(STATUS[0],)).pagina(25).sql(),
+        MaterialesQuery().pagina(50).sql(),
+        MaterialesQuery(orden=()).sql("COUNT(*) AS n"),
+        MaterialesQuery(lineas=("DP 02",)).buscar("MAT-1A válvula", ["ID_Material", "Descripcion"]).pagina(50).sql(),
+        MaterialesQuery().buscar("SOL-2026", FTS_COLS).pagina(25).sql(),
+        ("SELECT Estatus, COUNT(*) AS n FROM materiales GROUP BY Estatus", []),
+        ("SELECT * FROM materiales WHERE ID_Material = ?", ["MAT-X"]),
+        ("SELECT * FROM importaciones WHERE ID_Importacion = ?", ["0" * 64]),
+        ("SELECT Fila, Datos, Errores FROM importacion_rechazos WHERE ID_Importacion = ? ORDER BY Fila", ["0" * 64]),
+    ]
+)
+
+# ---------------------------
+# ESTATUS HISTÓRICO (checkpoints semanales sobre historial)
+# ---------------------------
+# Por cada semana ISO ya cerrada: checkpoint_semanas la marca como procesada, estatus_cambios guarda solo los
+# materiales cuyo estatus al cierre (lunes siguiente) cambió respecto al cierre anterior y conteo_cierre el conteo
+# por estatus al cierre. El estatus al cierre de la semana W = el último cambio <= W de cada material.
+# "Estatus a la fecha X" = estatus al último cierre antes de X + último evento de historial de cada material entre ese
+# cierre y X, así nunca se reproduce más de una semana de eventos. Supone historial append-only (Fecha_Evento = now_iso()).
+# Tamaño esperado: estatus_cambios ≈ una fila por transición de estatus que sobrevive al cierre de su semana (a lo más
+# las filas de historial), no materiales × semanas; conteo_cierre ≈ semanas × estatus.
+
+# Último evento de cada material en [desde, hasta).
+ULTIMO_EVENTO_SQL = """
+    SELECT ID_Material, Estatus_Nuevo AS Estatus FROM (
+        SELECT ID_Material, Estatus_Nuevo,
+               ROW_NUMBER() OVER (PARTITION BY ID_Material ORDER BY Fecha_Evento DESC, rowid DESC) AS rn
+        FROM historial WHERE Fecha_Evento >= ? AND Fecha_Evento < ?
+    ) WHERE rn = 1
+"""
+
+# Estatus de cada material al cierre de la semana del parámetro ("" = ninguno). SQLite toma las columnas sueltas de
+# la fila del MAX(Semana) de cada grupo.
+ESTATUS_CIERRE_SQL = """
+    SELECT ID_Material, Estatus FROM (
+        SELECT ID_Material, Estatus, MAX(Semana) FROM estatus_cambios WHERE Semana <= ? GROUP BY ID_Material
+    )
+"""
+
+# Estatus al cierre de una semana para un solo material (correlacionada por índice; params: semana).
+ESTATUS_CIERRE_MATERIAL_SQL = (
+    "SELECT c.Estatus FROM estatus_cambios c WHERE c.ID_Material = {id} AND c.Semana <= ? "
+    "ORDER BY c.Semana DESC LIMIT 1"
+)
+
+# Params: desde, hasta (eventos a reproducir), semana del checkpoint base ("" = sin checkpoint).
+ESTATUS_AL_SQL = f"""
+    WITH eventos AS ({ULTIMO_EVENTO_SQL})
+    SELECT ID_Material, Estatus FROM ({ESTATUS_CIERRE_SQL})
+    WHERE ID_Material NOT IN (SELECT ID_Material FROM eventos)
+    UNION ALL
+    SELECT ID_Material, Estatus FROM eventos
+"""
+
+# Cambios que deja la semana: el último evento de cada material en la semana contra su estatus al cierre anterior.
+# Params: semana anterior ("" = ninguna), desde, hasta. Estatus_Anterior NULL = el material aún no existía.
+CAMBIOS_SEMANA_SQL = f"""
+    SELECT ID_Material, Estatus, Estatus_Anterior FROM (
+        SELECT e.ID_Material, e.Estatus, ({ESTATUS_CIERRE_MATERIAL_SQL.format(id="e.ID_Material")}) AS Estatus_Anterior
+        FROM ({ULTIMO_EVENTO_SQL}) e
+    ) WHERE Estatus_Anterior IS NOT Estatus
+"""
+
+def semana_siguiente(semana: str, n: int = 1) -> str:
+    lunes = date.fromisoformat(iso_week_bounds(semana)[0])
+    return iso_week(lunes + timedelta(days=7 * n))
+
+def extender_checkpoints(hoy: Optional[date] = None) -> int:
+    """Agrega los checkpoints de las semanas cerradas que falten (incremental). Regresa cuántas semanas agregó."""
+    objetivo = iso_week((hoy or date.today()) - timedelta(days=7))
+    conn = db()
+    try:
+        ultima = conn.execute("SELECT MAX(Semana) FROM checkpoint_semanas").fetchone()[0]
+        if ultima is not None and ultima >= objetivo:
+            return 0
+
+        # IMMEDIATE: si dos sesiones llegan a la vez, la segunda vuelve a leer y no duplica semanas.
+        conn.execute("BEGIN IMMEDIATE")
+        ultima = conn.execute("SELECT MAX(Semana) FROM checkpoint_semanas").fetchone()[0]
+        if ultima is None:
+            primero = conn.execute("SELECT MIN(Fecha_Evento) FROM historial").fetchone()[0]
+            if primero is None:
+                conn.rollback()
+                return 0
+            semana = iso_week(date.fromisoformat(primero[:10]))
+        else:
+            semana = semana_siguiente(ultima)
+
+        conteo = dict(conn.execute("SELECT Estatus, Cantidad FROM conteo_cierre WHERE Semana = ?", (ultima or "",)).fetchall())
+        n = 0
+        while semana <= objetivo:
+            desde, hasta = iso_week_bounds(semana)
+            cambios = conn.execute(CAMBIOS_SEMANA_SQL, (ultima or "", desde, hasta)).fetchall()
+            conn.executemany(
+                "INSERT INTO estatus_cambios (Semana, ID_Material, Estatus) VALUES (?, ?, ?)",
+                [(semana, c["ID_Material"], c["Estatus"]) for c in cambios],
+            )
+            conn.execute("INSERT INTO checkpoint_semanas (Semana, Cambios) VALUES (?, ?)", (semana, len(cambios)))
+            for c in cambios:
+                conteo[c["Estatus"]] = conteo.get(c["Estatus"], 0) + 1
+                if c["Estatus_Anterior"] is not None:
+                    conteo[c["Estatus_Anterior"]] -= 1
+            conn.executemany(
+                "INSERT INTO conteo_cierre (Semana, Estatus, Cantidad) VALUES (?, ?, ?)",
+                [(semana, estatus, cantidad) for estatus, cantidad in conteo.items() if cantidad > 0],
+            )
+            ultima, semana = semana, semana_siguiente(semana)
+            n += 1
+        if n:
+            # Semanas nuevas cambian conteo_semanal / estatus_al: los caches por versión deben releer.
+            bump_data_version(conn.cursor())
+        conn.commit()
+        return n
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _checkpoint_antes(corte: str) -> Optional[str]:
+    # La semana anterior a la que contiene `corte` es la última cuyo cierre ya pasó.
+    candidata = semana_siguiente(iso_week(date.fromisoformat(corte[:10])), -1)
+    conn = db()
+    row = conn.execute("SELECT MAX(Semana) FROM checkpoint_semanas WHERE Semana <= ?", (candidata,)).fetchone()
+    conn.close()
+    return row[0]
+
+def estatus_al(corte: str) -> pd.DataFrame:
+    """Estatus de cada material al instante `corte` (fecha ISO, exclusivo): ID_Material, Estatus."""
+    extender_checkpoints()
+    cp = _checkpoint_antes(corte)
+    desde = iso_week_bounds(cp)[1] if cp else ""
+    return _read_sql_cached(ESTATUS_AL_SQL, (desde, corte, cp or ""), read_data_version())
+
+def estatus_semana(semana: str) -> pd.DataFrame:
+    """Estatus de cada material al cierre de la semana ISO (la semana en curso: al día de hoy)."""
+    return estatus_al(iso_week_bounds(semana)[1])
+
+# Semanas congeladas (snapshot_conteos) + las cerradas que el scheduler aún no congela (checkpoints). Se congela en
+# orden, así que las pendientes son siempre las posteriores a la última congelada.
+CONTEO_SEMANAL_SQL = """
+    SELECT Semana AS Semana_ISO, Estatus, Cantidad FROM snapshot_conteos
+    UNION ALL
+    SELECT Semana, Estatus, Cantidad FROM conteo_cierre
+    WHERE Semana > (SELECT IFNULL(MAX(Semana), '') FROM snapshots)
+"""
+
+def conteo_semanal() -> pd.DataFrame:
+    """Semana_ISO, Estatus, Cantidad: el pipeline completo al cierre de cada semana, incluida la actual."""
+    extender_checkpoints()
+    df = _read_sql_cached(CONTEO_SEMANAL_SQL, (), read_data_version())
+    actual = iso_week(date.today())
+    hoy = estatus_semana(actual).groupby("Estatus").size().reset_index(name="Cantidad")
+    hoy.insert(0, "Semana_ISO", actual)
+    return pd.concat([df, hoy], ignore_index=True)
+
+def diff_semanas(semana_a: str, semana_b: str) -> pd.DataFrame:
+    """Materiales cuyo estatus al cierre cambió entre semana_a y semana_b (Estatus_A vacío = aún no existía)."""
+    a = estatus_semana(semana_a).rename(columns={"Estatus": "Estatus_A"})
+    b = estatus_semana(semana_b).rename(columns={"Estatus": "Estatus_B"})
+    d = a.merge(b, on="ID_Material", how="outer")
+    return d[d["Estatus_A"] != d["Estatus_B"]].sort_values("ID_Material").reset_index(drop=True)
+
+QUERY_PLAN_CHECKS.extend([
+    (ESTATUS_AL_SQL, ["2026-01-12", "2026-01-14", "2026-W02"], False),
+    (CAMBIOS_SEMANA_SQL, ["2026-W01", "2026-01-05", "2026-01-12"], False),
+    ("SELECT MAX(Semana) FROM checkpoint_semanas WHERE Semana <= ?", ["2026-W02"], False),
+    (CONTEO_SEMANAL_SQL, [], True),
+])
+
+INSERT_MATERIAL_SQL = """
+    INSERT INTO materiales (
+        ID_Material, ID_Solicitud, Fecha_Solicitud, Ingeniero, Linea, Prioridad, Comentario_Solicitud,
+        Item, Descripcion, Estacion, Categoria, Frecuencia_Cambio, Cant_Stock_Requerida, Cant_Equipos,
+        Cant_Partes_Equipo, RP_Sugerido, Manufacturer, Estatus, Practicante_Asignado,
+        Comentario_Estatus, Material_SAP, InfoRecord_SAP,
+        Fecha_Revision, Fecha_Cotizacion, Fecha_Alta_SAP, Fecha_InfoRecord, Fecha_Finalizada
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+INSERT_HISTORIAL_SQL = """
+    INSERT INTO historial (
+        ID_Evento, ID_Material, Fecha_Evento, Usuario, Rol, Estatus_Anterior, Estatus_Nuevo, Comentario
+    ) VALUES (?,?,?,?,?,?,?,?)
+"""
+
+# La versión se asigna en la misma sentencia: siguiente a la mayor del material (índice ID_Material, Version).
+INSERT_ARCHIVO_SQL = """
+    INSERT INTO archivos (
+        ID_Archivo, ID_Material, Version, Nombre_Original, Nombre_Almacenado,
+        Mime, Size_Bytes, Fecha_Subida, Subido_Por, Sha256
+    )
+    SELECT ?, ?, COALESCE(MAX(Version), 0) + 1, ?, ?, ?, ?, ?, ?, ?
+    FROM archivos WHERE ID_Material = ?
+"""
+
+def _material_params(r: dict) -> tuple:
+    return (
+        r["ID_Material"], r["ID_Solicitud"], r["Fecha_Solicitud"], r["Ingeniero"], r["Linea"], r["Prioridad"],
+        r.get("Comentario_Solicitud",""),
+        r.get("Item",""), r["Descripcion"], r.get("Estacion",""), r.get("Categoria",""),
+        r.get("Frecuencia_Cambio",""),
+        float(r.get("Cant_Stock_Requerida", 0.0)),
+        int(float(r.get("Cant_Equipos", 0) or 0)),
+        int(float(r.get("Cant_Partes_Equipo", 0) or 0)),
+        r.get("RP_Sugerido",""), r.get("Manufacturer",""),
+        r.get("Estatus","En revisión de ingeniería"),
+        r.get("Practicante_Asignado",""),
+        r.get("Comentario_Estatus",""),
+        r.get("Material_SAP",""),
+        r.get("InfoRecord_SAP",""),
+        r.get("Fecha_Revision"),
+        r.get("Fecha_Cotizacion"),
+        r.get("Fecha_Alta_SAP"),
+        r.get("Fecha_InfoRecord"),
+        r.get("Fecha_Finalizada"),
+    )
+
+def _historial_params(id_material: str, estatus_old: str, estatus_new: str, comentario: str, usuario: str, rol: str) -> tuple:
+    return (f"EVT-{uuid.uuid4().hex[:12].upper()}", id_material, now_iso(), usuario, rol, estatus_old, estatus_new, comentario)
+
+def _archivo_params(meta: dict) -> tuple:
+    return (
+        meta["ID_Archivo"], meta["ID_Material"], meta["Nombre_Original"], meta["Nombre_Almacenado"],
+        meta["Mime"], meta["Size_Bytes"], meta["Fecha_Subida"], meta["Subido_Por"], meta["Sha256"],
+        meta["ID_Material"],
+    )
+
+@cronometrado("insert_materiales")
+def insert_materiales(registros: list[dict]) -> None:
+    conn = db()
+    cur = conn.cursor()
+    cur.executemany(INSERT_MATERIAL_SQL, [_material_params(r) for r in registros])
+    bump_data_version(cur)
+    conn.commit()
+    conn.close()
+
+@cronometrado("write_historial_event")
+def write_historial_event(id_material: str, estatus_old: str, estatus_new: str, comentario: str, usuario: str, rol: str):
+    conn = db()
+    cur = conn.cursor()
+    cur.execute(INSERT_HISTORIAL_SQL, _historial_params(id_material, estatus_old, estatus_new, comentario, usuario, rol))
+    bump_data_version(cur)
+    conn.commit()
+    conn.close()
+
+@cronometrado("ingest_solicitud")
+def ingest_solicitud(
+    registros: list[dict],
+    usuario: str,
+    rol: str,
+    comentario_evento: str,
+    extra: Optional[Callable[[sqlite3.Cursor], None]] = None,
+) -> int:
+    """Alta de una solicitud en una sola transacción: materiales, eventos CREADO y metadatos de adjuntos.
+
+    Los adjuntos (clave "Archivo" de cada registro) se escriben al almacén de blobs antes de abrir la
+    transacción; si el commit falla quedan sin referencia y los borra purgar_blobs() pasado el periodo de
+    gracia. `extra` corre dentro de la misma transacción (p. ej. el avance de una importación).
+    """
+    if not registros and extra is None:
+        return 0
+
+    archivos = [_store_archivo(r["Archivo"], r["ID_Material"], usuario) for r in registros if r.get("Archivo") is not None]
+
+    conn = db()
+    try:
+        with conn:
+            cur = conn.cursor()
+            cur.executemany(INSERT_MATERIAL_SQL, [_material_params(r) for r in registros])
+            cur.executemany(
+                INSERT_HISTORIAL_SQL,
+                [_historial_params(r["ID_Material"], "CREADO", r["Estatus"], comentario_evento, usuario, rol) for r in registros],
+            )
+            cur.executemany(INSERT_ARCHIVO_SQL, [_archivo_params(m) for m in archivos])
+            if extra is not None:
+                extra(cur)
+            bump_data_version(cur)
+    finally:
+        conn.close()
+    return len(registros)
+
+@cronometrado("aplicar_transiciones")
+def aplicar_transiciones(transiciones: list[dict], usuario: str, rol: str) -> list[dict]:
+    """Aplica uno o varios cambios de estatus en una sola transacción, con su historial en el mismo commit.
+
+    Cada transición es un dict con ID_Material, Estatus (nuevo), Comentario y opcionalmente
+    Material_SAP / InfoRecord_SAP. Regresa un resultado por transición, en el mismo orden:
+    {"ID_Material", "ok", "Estatus_Anterior", "Estatus_Nuevo", "error"}.
+    """
+    resultados = []
+    if not transiciones:
+        return resultados
+
+    conn = db()
+    try:
+        # IMMEDIATE: toma el lock de escritura antes del SELECT, así nadie cambia el estatus entre lectura y UPDATE.
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        eventos = []
+        for t in transiciones:
+            id_material = t["ID_Material"]
+            nuevo_estatus = t["Estatus"]
+            res = {"ID_Material": id_material, "ok": False, "Estatus_Anterior": None, "Estatus_Nuevo": nuevo_estatus, "error": ""}
+            resultados.append(res)
+
+            if nuevo_estatus not in STATUS:
+                res["error"] = "Estatus inválido."
+                continue
+            row = cur.execute("SELECT Estatus FROM materiales WHERE ID_Material = ?", (id_material,)).fetchone()
+            if not row:
+                res["error"] = "Material no encontrado."
+                continue
+
+            estatus_old = row["Estatus"]
+            comentario = t.get("Comentario", "")
+
+            fecha_col = FECHA_MAP.get(nuevo_estatus)
+            fields = ["Estatus = ?", "Comentario_Estatus = ?"]
+            params = [nuevo_estatus, comentario]
+
+            if t.get("Material_SAP") is not None:
+                fields.append("Material_SAP = ?")
+                params.append(t["Material_SAP"])
+            if t.get("InfoRecord_SAP") is not None:
+                fields.append("InfoRecord_SAP = ?")
+                params.append(t["InfoRecord_SAP"])
+
+            if fecha_col:
+                fields.append(f"{fecha_col} = ?")
+                params.append(now_iso())
+
+            params.append(id_material)
+            cur.execute(f"UPDATE materiales SET {', '.join(fields)} WHERE ID_Material = ?", params)
+            eventos.append(_historial_params(id_material, estatus_old, nuevo_estatus, comentario, usuario, rol))
+
+            res["ok"] = True
+            res["Estatus_Anterior"] = estatus_old
+
+        if eventos:
+            cur.executemany(INSERT_HISTORIAL_SQL, eventos)
+            bump_data_version(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return resultados
+
+def update_estatus_material(
+    id_material: str,
+    nuevo_estatus: str,
+    comentario: str,
+    usuario: str,
+    rol: str,
+    material_sap: Optional[str] = None,
+    inforecord_sap: Optional[str] = None,
+) -> bool:
+    res = aplicar_transiciones(
+        [{
+            "ID_Material": id_material,
+            "Estatus": nuevo_estatus,
+            "Comentario": comentario,
+            "Material_SAP": material_sap,
+            "InfoRecord_SAP": inforecord_sap,
+        }],
+        usuario,
+        rol,
+    )
+    return res[0]["ok"]
+
+BLOB_CHUNK = 1024 * 1024
+# Un blob sin referencias se borra solo si nadie lo escribió ni lo reutilizó en este tiempo: una alta en curso que
+# ya lo tiene en disco pero aún no hace commit no pierde el archivo.
+BLOB_GRACIA_S = 3600
+
+def _blob_path(sha: str) -> Path:
+    return BLOBS_DIR / sha[:2] / sha
+
+def _store_blob(f) -> tuple[str, int]:
+    """Copia el archivo por bloques a un temporal mientras calcula su SHA-256 y lo deja en blobs/<sha[:2]>/<sha>.
+
+    Regresa (sha256, tamaño); si ese contenido ya estaba guardado se descarta la copia y se renueva la fecha del
+    blob, para que purgar_blobs() no lo tome por huérfano mientras la fila de archivos se guarda.
+    """
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=BLOBS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            f.seek(0)
+            for block in iter(lambda: f.read(BLOB_CHUNK), b""):
+                h.update(block)
+                out.write(block)
+                size += len(block)
+        f.seek(0)
+        sha = h.hexdigest()
+        dest = _blob_path(sha)
+        try:
+            os.utime(dest)
+            os.unlink(tmp)
+            return sha, size
+        except FileNotFoundError:
+            pass
+        dest.parent.mkdir(exist_ok=True)
+        os.replace(tmp, dest)
+        return sha, size
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def purgar_blobs(gracia_s: int = BLOB_GRACIA_S) -> int:
+    """Borra los blobs (con sus vistas previas, y temporales .part) que ninguna fila de archivos referencia y que
+    llevan más de `gracia_s` sin escribirse ni reutilizarse. Regresa cuántos borró. Lo corre el scheduler del proceso.
+    """
+    if not BLOBS_DIR.exists():
+        return 0
+    corte = time.time() - gracia_s
+    viejos = [p for p in BLOBS_DIR.glob("*/*") if p.is_file() and p.stat().st_mtime < corte]
+    for p in BLOBS_DIR.glob("*.part"):
+        if p.stat().st_mtime < corte:
+            p.unlink(missing_ok=True)
+    conn = db()
+    try:
+        # IMMEDIATE: nadie puede hacer commit de una referencia entre la revisión y el borrado del archivo.
+        conn.execute("BEGIN IMMEDIATE")
+        muertos = []
+        for p in viejos:
+            if conn.execute("SELECT 1 FROM archivos WHERE Sha256 = ? LIMIT 1", (p.name,)).fetchone():
+                continue
+            try:
+                # Se vuelve a revisar la fecha: _store_blob pudo reutilizarlo después del glob.
+                if p.stat().st_mtime >= corte:
+                    continue
+                # Vistas previas antes que el blob: si el mismo contenido se vuelve a subir, _store_archivo ya no
+                # las encuentra y encola otras. (Las de PDF son compartidas y no dependen del sha.)
+                for sufijo in ("thumb", "preview"):
+                    (PREVIEWS_DIR / p.name[:2] / f"{p.name}_{sufijo}.jpg").unlink(missing_ok=True)
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            muertos.append(p.name)
+        conn.executemany("DELETE FROM blobs WHERE Sha256 = ?", [(sha,) for sha in muertos])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(muertos)
+
+# Miniaturas y vistas previas (JPEG, acotadas): una por contenido, en previews/<sha[:2]>/. Los PDF comparten un
+# placeholder de primera página; Pillow no rasteriza PDF.
+THUMB_SIZE = (160, 160)
+PREVIEW_SIZE = (1024, 1024)
+PREVIEW_QUALITY = 82
+PDF_COLOR = "#C62828"
+PREVIEW_EXT_IMAGEN = {".png", ".jpg", ".jpeg"}
+
+def _save_jpeg(img: Image.Image, dest: Path) -> None:
+    # Temporal + replace: dos sesiones que generan la misma vista previa no dejan un archivo a medias.
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            img.save(out, "JPEG", quality=PREVIEW_QUALITY, optimize=True)
+        os.replace(tmp, dest)
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+def _pdf_placeholder(size: tuple[int, int]) -> Image.Image:
+    h = size[1]
+    w = int(h * 0.707)
+    img = Image.new("RGB", (w, h), "white")
+    d = ImageDraw.Draw(img)
+    m = max(2, h // 40)
+    d.rectangle([m, m, w - m - 1, h - m - 1], outline="#BDBDBD", width=max(1, h // 120))
+    for i in range(6):
+        y = int(h * (0.18 + i * 0.07))
+        d.line([w * 0.15, y, w * (0.85 if i % 3 else 0.6), y], fill="#E0E0E0", width=max(1, h // 80))
+    d.rectangle([0, int(h * 0.66), w, int(h * 0.82)], fill=PDF_COLOR)
+    font = ImageFont.load_default(size=max(10, h // 10))
+    d.text((w / 2, h * 0.74), "PDF", fill="white", font=font, anchor="mm")
+    return img
+
+def _pdf_previews() -> tuple[Path, Path]:
+    thumb, preview = preview_paths("", ".pdf")
+    if not thumb.exists():
+        _save_jpeg(_pdf_placeholder(THUMB_SIZE), thumb)
+    if not preview.exists():
+        _save_jpeg(_pdf_placeholder((PREVIEW_SIZE[0], PREVIEW_SIZE[1] // 2)), preview)
+    return thumb, preview
+
+def preview_paths(sha: str, nombre: str) -> Optional[tuple[Path, Path]]:
+    """(miniatura, vista previa) que le tocan al blob `sha`; None si el tipo de archivo no tiene vista previa."""
+    ext = Path(nombre).suffix.lower()
+    if ext == ".pdf":
+        return PREVIEWS_DIR / "pdf_thumb.jpg", PREVIEWS_DIR / "pdf_preview.jpg"
+    if ext not in PREVIEW_EXT_IMAGEN:
+        return None
+    return PREVIEWS_DIR / sha[:2] / f"{sha}_thumb.jpg", PREVIEWS_DIR / sha[:2] / f"{sha}_preview.jpg"
+
+def generar_previews(sha: str, nombre: str) -> Optional[tuple[Path, Path]]:
+    """Genera (si faltan) la miniatura y la vista previa del blob `sha`. None si no hay vista previa posible."""
+    paths = preview_paths(sha, nombre)
+    if paths is None:
+        return None
+    if Path(nombre).suffix.lower() == ".pdf":
+        return _pdf_previews()
+
+    thumb, preview = paths
+    if thumb.exists() and preview.exists():
+        return thumb, preview
+    try:
+        with Image.open(_blob_path(sha)) as src:
+            src.draft("RGB", PREVIEW_SIZE)  # JPEG: decodifica ya reducido
+            img = ImageOps.exif_transpose(src)
+            if img.mode in ("RGBA", "LA", "P"):
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, "white")
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                img = img.convert("RGB")
+            img.thumbnail(PREVIEW_SIZE)
+            _save_jpeg(img, preview)
+            img.thumbnail(THUMB_SIZE)
+            _save_jpeg(img, thumb)
+    except (OSError, Image.DecompressionBombError):
+        # Imagen dañada o no soportada: el adjunto se guarda igual, solo sin vista previa.
+        return None
+    return thumb, preview
+
+def _store_archivo(uploaded_file, id_material: str, usuario: str) -> dict:
+    # Guarda el contenido en el almacén de blobs y regresa los metadatos (la fila de archivos se inserta aparte;
+    # la versión la asigna INSERT_ARCHIVO_SQL).
+    sha, size = _store_blob(uploaded_file)
+    pv = preview_paths(sha, uploaded_file.name)
+    if pv and not pv[1].exists():
+        encolar_job("previews", {"sha": sha, "nombre": uploaded_file.name}, usuario, llave=f"previews:{sha}")
+    return {
+        "ID_Archivo": f"FILE-{uuid.uuid4().hex[:12].upper()}",
+        "ID_Material": id_material,
+        "Nombre_Original": uploaded_file.name,
+        "Nombre_Almacenado": _blob_path(sha).relative_to(FILES_DIR).as_posix(),
+        "Mime": uploaded_file.type or "",
+        "Size_Bytes": size,
+        "Fecha_Subida": now_iso(),
+        "Subido_Por": usuario,
+        "Sha256": sha,
+    }
+
+@cronometrado("guardar_archivo_versionado")
+def guardar_archivo_versionado(uploaded_file, id_material: str, usuario: str) -> Optional[dict]:
+    if uploaded_file is None:
+        return None
+
+    meta = _store_archivo(uploaded_file, id_material, usuario)
+
+    conn = db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        cur.execute(INSERT_ARCHIVO_SQL, _archivo_params(meta))
+        meta["Version"] = cur.execute("SELECT Version FROM archivos WHERE ID_Archivo = ?", (meta["ID_Archivo"],)).fetchone()["Version"]
+        bump_data_version(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return meta
+
+# Fuente de una hoja de Excel: un DataFrame ya en memoria o una consulta (sql, params) que se lee por cursor.
+ExcelSource = Union[pd.DataFrame, tuple[str, list]]
+
+EXPORT_CHUNK = 2000
+# Tope de filas de una hoja de Excel (1,048,576 con el encabezado); lo que sobra sigue en "<hoja> (2)", "(3)"…
+EXCEL_MAX_FILAS = 1048575
+
+def _excel_value(v):
+    # NaN / NaT / None -> celda vacía (como na_rep="" de pandas); Timestamp -> datetime.
+    if pd.api.types.is_scalar(v) and pd.isna(v):
+        return None
+    if isinstance(v, pd.Timestamp):
+        return v.to_pydatetime()
+    return v
+
+def _excel_fecha(v):
+    # Las fechas viven como texto ISO en SQLite; en Excel se escriben como datetime (igual que el frame parseado).
+    if not v:
+        return None
+    try:
+        return datetime.fromisoformat(str(v))
+    except ValueError:
+        return None
+
+def _excel_header(ws, cols: list[str]) -> list:
+    header = []
+    for c in cols:
+        cell = WriteOnlyCell(ws, value=str(c))
+        cell.font = Font(bold=True)
+        header.append(cell)
+    return header
+
+@cronometrado("write_excel")
+def write_excel(sheets: Dict[str, ExcelSource], dest) -> None:
+    """Escribe un libro de Excel fila por fila (openpyxl write-only) en dest (ruta o archivo binario).
+
+    Las hojas con (sql, params) se leen del cursor en bloques de EXPORT_CHUNK filas, así la memoria
+    no crece con el tamaño de la tabla; si pasan de EXCEL_MAX_FILAS siguen en hojas numeradas.
+    Los nombres de hoja se recortan a 31 caracteres.
+    """
+    wb = Workbook(write_only=True)
+    for name, src in sheets.items():
+        ws = wb.create_sheet(title=name[:31])
+        if isinstance(src, pd.DataFrame):
+            ws.append(_excel_header(ws, list(src.columns)))
+            for row in src.itertuples(index=False, name=None):
+                ws.append([_excel_value(v) for v in row])
+            continue
+
+        sql, params = src
+        conn = db()
+        try:
+            cur = conn.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            fechas = {i for i, c in enumerate(cols) if c.startswith("Fecha_")}
+            ws.append(_excel_header(ws, cols))
+            en_hoja, hoja = 0, 1
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                for r in rows:
+                    if en_hoja == EXCEL_MAX_FILAS:
+                        hoja += 1
+                        sufijo = f" ({hoja})"
+                        ws = wb.create_sheet(title=name[:31 - len(sufijo)] + sufijo)
+                        ws.append(_excel_header(ws, cols))
+                        en_hoja = 0
+                    ws.append([_excel_fecha(v) if i in fechas else v for i, v in enumerate(r)])
+                    en_hoja += 1
+        finally:
+            conn.close()
+    wb.save(dest)
+
+def excel_file_from_sources(sheets: Dict[str, ExcelSource]) -> Path:
+    # El libro se arma en un archivo temporal (no en RAM); quien lo use decide cuándo borrarlo.
+    fd, tmp = tempfile.mkstemp(prefix="bosch_export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        write_excel(sheets, tmp)
+    except Exception:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return Path(tmp)
+
+def excel_bytes_from_dfs(sheets: Dict[str, ExcelSource]) -> bytes:
+    path = excel_file_from_sources(sheets)
+    try:
+        return path.read_bytes()
+    finally:
+        path.unlink(missing_ok=True)
+
+# ---------------------------
+# EXPORT CACHE (payloads de descarga bajo demanda)
+# ---------------------------
+EXPORT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+EXPORT_CACHE_MAX_AGE_S = 30 * 60
+
+class ExportCache:
+    """Archivos de export ya generados, por (tipo, parámetros, versión de datos); LRU acotado por tamaño y edad.
+
+    La llave siempre termina en la versión de datos.
+    """
+
+    def __init__(self, max_bytes: int, max_age_s: int):
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._items: "OrderedDict[tuple, tuple[Path, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        # Se lee dentro del lock: un put() de otra versión o _evict() en otro hilo pueden borrar el archivo.
+        with self._lock:
+            self._evict()
+            item = self._items.get(key)
+            if item is None:
+                return None
+            try:
+                data = item[0].read_bytes()
+            except FileNotFoundError:
+                self._items.pop(key)
+                return None
+            self._items.move_to_end(key)
+            return data
+
+    def put(self, key: tuple, path: Path) -> None:
+        with self._lock:
+            # Las versiones anteriores del mismo (tipo, parámetros) ya no se van a pedir.
+            for k in [k for k in self._items if k[:-1] == key[:-1]]:
+                old_path = self._items.pop(k)[0]
+                if old_path != path:
+                    old_path.unlink(missing_ok=True)
+            self._items[key] = (path, path.stat().st_size, time.monotonic())
+            self._evict()
+
+    def _evict(self) -> None:
+        ahora = time.monotonic()
+        for key, (path, _, creado) in list(self._items.items()):
+            if ahora - creado > self.max_age_s:
+                self._items.pop(key)
+                path.unlink(missing_ok=True)
+        total = sum(size for _, size, _ in self._items.values())
+        while total > self.max_bytes and len(self._items) > 1:
+            _, (path, size, _) = self._items.popitem(last=False)
+            path.unlink(missing_ok=True)
+            total -= size
+
+@_por_proceso
+def export_cache() -> ExportCache:
+    return ExportCache(EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_MAX_AGE_S)
+
+def export_payload(
+    cache: ExportCache,
+    kind: str,
+    params: tuple,
+    build: Callable[[], Dict[str, ExcelSource]],
+    version: Optional[int] = None,
+) -> bytes:
+    """Bytes del Excel (kind, params) para la versión de datos actual; solo se arma si no está en cache.
+
+    Pensado para el data= callable de un download_button: corre al hacer clic, fuera del script.
+    Para datos inmutables (snapshots congelados) se pasa una `version` fija y la llave no cambia con las escrituras.
+    """
+    key = (kind, params, read_data_version() if version is None else version)
+    data = cache.get(key)
+    if data is None:
+        path = excel_file_from_sources(build())
+        # Se lee antes de entregarlo al cache: desde put() otro hilo ya lo puede reemplazar o desalojar.
+        data = path.read_bytes()
+        cache.put(key, path)
+    return data
+
+def template_sheets() -> Dict[str, ExcelSource]:
+    df = pd.DataFrame(columns=IMPORT_COLS)
+    info = pd.DataFrame(
+        [
+            ["INSTRUCCIONES",
+             "1) No borres encabezados. 2) 'Descripcion' obligatoria. 3) Categoria: MAZE/FHMI/HIBE.",
+             "4) Linea debe existir en catálogo. 5) Prioridad: Alta/Media/Baja. 6) Sube el archivo en 'Excel masivo'."]
+        ],
+        columns=["Campo", "Regla", "Notas"]
+    )
+    return {"Template": df, "Guia": info}
+
+def template_excel_bytes() -> bytes:
+    return excel_bytes_from_dfs(template_sheets())
+
+def validate_record(r: dict) -> list[str]:
+    errors = []
+    if not str(r.get("Descripcion","")).strip():
+        errors.append("Descripcion obligatoria.")
+    if str(r.get("Linea","")) not in LINEAS:
+        errors.append("Linea inválida (fuera de catálogo).")
+    if str(r.get("Prioridad","")) not in ["Alta","Media","Baja"]:
+        errors.append("Prioridad inválida.")
+    if str(r.get("Categoria","")) and str(r.get("Categoria","")) not in CATEGORIAS_MATERIAL:
+        errors.append("Categoria inválida.")
+    try:
+        stock = float(r.get("Cant_Stock_Requerida", 0) or 0)
+        if stock < 0:
+            errors.append("Cant_Stock_Requerida no puede ser negativa.")
+    except Exception:
+        errors.append("Cant_Stock_Requerida debe ser numérica.")
+    # Del Excel llegan como texto o float: "2.5" o "abc" se rechazan aquí, no al insertar el bloque.
+    for c in ["Cant_Equipos", "Cant_Partes_Equipo"]:
+        try:
+            n = float(r.get(c, 0) or 0)
+            if not n.is_integer() or n < 0:
+                errors.append(f"{c} debe ser un entero no negativo.")
+        except Exception:
+            errors.append(f"{c} debe ser un entero no negativo.")
+    return errors
+
+def assign_practicante(linea: str) -> str:
+    for resp, lineas in LINEAS_POR_PRACTICANTE.items():
+        if linea in lineas:
+            return resp
+    return ""
+
+# ---------------------------
+# SNAPSHOTS SEMANALES (congelados al cierre)
+# ---------------------------
+# Al cerrar cada semana ISO se copian, una sola vez: los materiales solicitados en la semana (con su estatus al
+# cierre), su historial hasta el cierre y el conteo del pipeline. Las descargas y comparaciones leen esas tablas
+# por llave primaria; triggers impiden modificarlas. Los campos del material son los del momento de congelar
+# (minutos después del cierre); estatus, historial y conteos salen exactos al cierre aunque se congele tarde.
+SNAPSHOT_REVISION_S = 15 * 60
+
+HISTORIAL_COLS = ["ID_Evento", "ID_Material", "Fecha_Evento", "Usuario", "Rol", "Estatus_Anterior", "Estatus_Nuevo", "Comentario"]
+
+def congelar_semana(semana: str, hoy: Optional[date] = None) -> bool:
+    """Congela la semana ISO `semana` si ya cerró; False si aún no cierra o ya estaba congelada."""
+    if semana > iso_week((hoy or date.today()) - timedelta(days=7)):
+        return False
+    extender_checkpoints(hoy)
+    ini, fin = iso_week_bounds(semana)
+    mat_cols = ", ".join(MATERIALES_COLS)
+    hist_cols = ", ".join(HISTORIAL_COLS)
+    conn = db()
+    try:
+        # IMMEDIATE: dos procesos (o el scheduler y un backfill manual) no congelan la misma semana dos veces.
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM snapshots WHERE Semana = ?", (semana,)).fetchone():
+            conn.rollback()
+            return False
+        n_mat = conn.execute(
+            f"INSERT INTO snapshot_materiales (Semana, {mat_cols}, Estatus_Cierre_Semana) "
+            f"SELECT ?, {', '.join('m.' + c for c in MATERIALES_COLS)}, "
+            f"({ESTATUS_CIERRE_MATERIAL_SQL.format(id='m.ID_Material')}) FROM materiales m "
+            "WHERE m.Fecha_Solicitud >= ? AND m.Fecha_Solicitud < ?",
+            (semana, semana, ini, fin),
+        ).rowcount
+        n_ev = conn.execute(
+            f"INSERT INTO snapshot_historial (Semana, {hist_cols}) SELECT ?, {', '.join('h.' + c for c in HISTORIAL_COLS)} "
+            "FROM snapshot_materiales s JOIN historial h ON h.ID_Material = s.ID_Material AND h.Fecha_Evento < ? "
+            "WHERE s.Semana = ?",
+            (semana, fin, semana),
+        ).rowcount
+        conn.execute(
+            "INSERT INTO snapshot_conteos (Semana, Estatus, Cantidad) "
+            "SELECT Semana, Estatus, Cantidad FROM conteo_cierre WHERE Semana = ?",
+            (semana,),
+        )
+        conn.execute("INSERT INTO snapshots (Semana, Fecha_Congelado, Materiales, Eventos) VALUES (?, ?, ?, ?)", (semana, now_iso(), n_mat, n_ev))
+        # La lista de snapshots y conteo_semanal se leen con cache por versión.
+        bump_data_version(conn.cursor())
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def congelar_semanas_cerradas(hoy: Optional[date] = None) -> list[str]:
+    """Congela, en orden, todas las semanas cerradas que falten (la primera vez hace el backfill completo)."""
+    extender_checkpoints(hoy)
+    conn = db()
+    primera = conn.execute("SELECT MIN(Semana) FROM checkpoint_semanas").fetchone()[0]
+    hechas = {r[0] for r in conn.execute("SELECT Semana FROM snapshots")}
+    conn.close()
+    if primera is None:
+        return []
+    ultima = iso_week((hoy or date.today()) - timedelta(days=7))
+    nuevas = []
+    semana = primera
+    while semana <= ultima:
+        if semana not in hechas and congelar_semana(semana, hoy):
+            nuevas.append(semana)
+        semana = semana_siguiente(semana)
+    return nuevas
+
+mantenimiento_logger = logging.getLogger("bosch.mantenimiento")
+
+class SnapshotScheduler:
+    """Hilo del proceso que congela semanas: al arrancar (pone al día lo atrasado), justo después de cada cierre
+    de semana y, por si algo falló, cada `intervalo_s`. En cada vuelta también barre blobs huérfanos y jobs viejos,
+    para que un servidor que no se reinicia no los acumule."""
+
+    def __init__(self, intervalo_s: int):
+        self.intervalo_s = intervalo_s
+        self.ultimo_error = ""
+        self._alto = threading.Event()
+        self._hilo = threading.Thread(target=self._ciclo, name="snapshots", daemon=True)
+        self._hilo.start()
+
+    def _ciclo(self) -> None:
+        while True:
+            try:
+                congelar_semanas_cerradas()
+                self.ultimo_error = ""
+            except Exception as e:
+                self.ultimo_error = str(e) or e.__class__.__name__
+            try:
+                purgar_blobs()
+                limpiar_jobs()
+            except Exception:
+                mantenimiento_logger.exception("Falló la limpieza periódica de blobs / jobs")
+            if self._alto.wait(self._espera()):
+                return
+
+    def _espera(self) -> float:
+        ahora = datetime.now()
+        proximo_lunes = datetime.combine(ahora.date() + timedelta(days=7 - ahora.weekday()), datetime.min.time())
+        return max(1.0, min(self.intervalo_s, (proximo_lunes - ahora).total_seconds() + 5))
+
+    def detener(self) -> None:
+        self._alto.set()
+
+@_por_proceso
+def snapshot_scheduler() -> SnapshotScheduler:
+    return SnapshotScheduler(SNAPSHOT_REVISION_S)
+
+def snapshots_congelados() -> pd.DataFrame:
+    """Semana, Fecha_Congelado, Materiales, Eventos de las semanas ya congeladas, la más reciente primero."""
+    return _read_sql_cached("SELECT * FROM snapshots ORDER BY Semana DESC", (), read_data_version())
+
+def snapshot_sheets(semana: str) -> Dict[str, ExcelSource]:
+    """Hojas del snapshot congelado de `semana`, leídas por llave primaria (sin recalcular nada)."""
+    return {
+        "Materiales": (
+            f"SELECT {', '.join(MATERIALES_COLS)}, Estatus_Cierre_Semana FROM snapshot_materiales WHERE Semana = ? ORDER BY ID_Material",
+            [semana],
+        ),
+        "Historial": (
+            f"SELECT {', '.join(HISTORIAL_COLS)} FROM snapshot_historial WHERE Semana = ? ORDER BY ID_Evento",
+            [semana],
+        ),
+        "Pipeline_Cierre": ("SELECT Estatus, Cantidad FROM snapshot_conteos WHERE Semana = ?", [semana]),
+    }
+
+QUERY_PLAN_CHECKS.extend(
+    [(sql, params, False) for sql, params in snapshot_sheets("2026-W02").values()]
+    + [("SELECT 1 FROM snapshots WHERE Semana = ?", ["2026-W02"], False)]
+)
+
+# ---------------------------
+# IMPORT (Excel masivo por bloques, reanudable)
+# ---------------------------
+IMPORT_CHUNK = 500
+
+IMPORT_COLS = [
+    "Ingeniero", "Linea", "Prioridad", "Comentario_Solicitud",
+    "Item", "Descripcion", "Estacion", "Categoria", "Frecuencia_Cambio",
+    "Cant_Stock_Requerida", "Cant_Equipos", "Cant_Partes_Equipo", "RP_Sugerido", "Manufacturer",
+]
+IMPORT_NUM_COLS = ["Cant_Stock_Requerida", "Cant_Equipos", "Cant_Partes_Equipo"]
+
+def file_sha256(f) -> str:
+    h = hashlib.sha256()
+    f.seek(0)
+    for block in iter(lambda: f.read(1024 * 1024), b""):
+        h.update(block)
+    f.seek(0)
+    return h.hexdigest()
+
+def leer_importacion(id_importacion: str) -> Optional[dict]:
+    conn = db()
+    row = conn.execute("SELECT * FROM importaciones WHERE ID_Importacion = ?", (id_importacion,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def _iniciar_importacion(id_importacion: str, nombre: str, usuario: str) -> dict:
+    conn = db()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO importaciones (
+                ID_Importacion, Nombre_Archivo, ID_Solicitud, Filas_Procesadas, Insertadas, Rechazadas,
+                Estado, Fecha_Inicio, Fecha_Fin, Usuario
+            ) VALUES (?,?,?,0,0,0,'EN_PROCESO',?,NULL,?)
+            """,
+            (id_importacion, nombre, generar_id_solicitud(), now_iso(), usuario),
+        )
+    conn.close()
+    return leer_importacion(id_importacion)
+
+def _avance_importacion(id_importacion: str, fila: int, insertadas: int, rechazados: list[tuple], completa: bool):
+    # Se ejecuta dentro de la transacción del bloque: el avance y los rechazos quedan registrados solo si el
+    # bloque se guardó. rechazados: (fila, datos json, errores).
+    rechazadas = len(rechazados)
+
+    def _update(cur: sqlite3.Cursor) -> None:
+        cur.executemany(
+            "INSERT OR IGNORE INTO importacion_rechazos (ID_Importacion, Fila, Datos, Errores) VALUES (?,?,?,?)",
+            [(id_importacion, f, datos, errores) for f, datos, errores in rechazados],
+        )
+        cur.execute(
+            """
+            UPDATE importaciones
+            SET Filas_Procesadas = ?, Insertadas = Insertadas + ?, Rechazadas = Rechazadas + ?,
+                Estado = ?, Fecha_Fin = ?
+            WHERE ID_Importacion = ?
+            """,
+            (fila, insertadas, rechazadas, "COMPLETA" if completa else "EN_PROCESO",
+             now_iso() if completa else None, id_importacion),
+        )
+    return _update
+
+def rechazos_importacion(id_importacion: str) -> pd.DataFrame:
+    """Fila, columnas del Template y Errores de todas las filas rechazadas de la importación (incluye reanudaciones)."""
+    conn = db()
+    rows = conn.execute(
+        "SELECT Fila, Datos, Errores FROM importacion_rechazos WHERE ID_Importacion = ? ORDER BY Fila", (id_importacion,)
+    ).fetchall()
+    conn.close()
+    return pd.DataFrame([{"Fila": r["Fila"], **json.loads(r["Datos"]), "Errores": r["Errores"]} for r in rows])
+
+def nuevo_registro(base: dict, id_sol: str) -> dict:
+    rec = dict(base)
+    rec["ID_Solicitud"] = id_sol
+    rec["ID_Material"] = generar_id_material()
+    rec["Fecha_Solicitud"] = now_iso()
+    rec["Estatus"] = "En revisión de ingeniería"
+    rec["Practicante_Asignado"] = assign_practicante(str(rec.get("Linea","")))
+    rec["Comentario_Estatus"] = ""
+    rec["Material_SAP"] = ""
+    rec["InfoRecord_SAP"] = ""
+    rec["Fecha_Revision"] = None
+    rec["Fecha_Cotizacion"] = None
+    rec["Fecha_Alta_SAP"] = None
+    rec["Fecha_InfoRecord"] = None
+    rec["Fecha_Finalizada"] = None
+    return rec
+
+def importar_excel(
+    fuente,
+    id_importacion: str,
+    nombre: str,
+    defaults: dict,
+    usuario: str,
+    rol: str,
+) -> Iterator[dict]:
+    """Importa la hoja 'Template' por bloques de IMPORT_CHUNK filas y va cediendo el avance.
+
+    Lee en modo read-only (fila por fila), valida cada fila con validate_record y guarda cada bloque
+    en su propia transacción junto con el avance en `importaciones`. Si el proceso se corta, volver a
+    llamar con el mismo id_importacion (hash del archivo) continúa después de la última fila guardada,
+    sin duplicar materiales. Las filas rechazadas se guardan con su bloque; se leen con rechazos_importacion().
+    """
+    wb = load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        if "Template" not in wb.sheetnames:
+            raise ValueError("El Excel debe contener la hoja 'Template' del archivo descargado.")
+        ws = wb["Template"]
+        rows = ws.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else "" for c in next(rows, ())]
+        missing = [c for c in IMPORT_COLS if c not in header]
+        if missing:
+            raise ValueError("Faltan columnas: " + ", ".join(missing))
+        idx = {c: header.index(c) for c in IMPORT_COLS}
+        total = max((ws.max_row or 1) - 1, 0)
+
+        estado = leer_importacion(id_importacion) or _iniciar_importacion(id_importacion, nombre, usuario)
+        avance = {
+            "ID_Solicitud": estado["ID_Solicitud"],
+            "procesadas": estado["Filas_Procesadas"],
+            "total": total,
+            "insertadas": estado["Insertadas"],
+            "rechazadas": estado["Rechazadas"],
+            "completa": estado["Estado"] == "COMPLETA",
+            "reanudada": estado["Filas_Procesadas"] > 0 and estado["Estado"] != "COMPLETA",
+        }
+        if avance["completa"]:
+            yield avance
+            return
+
+        registros, rechazados_bloque, fila = [], [], 0
+        for fila, values in enumerate(rows, start=1):
+            if fila <= estado["Filas_Procesadas"]:
+                continue
+            if values is None or all(v is None or str(v).strip() == "" for v in values):
+                continue
+
+            base = {}
+            for c, i in idx.items():
+                v = values[i] if i < len(values) else None
+                if c in IMPORT_NUM_COLS:
+                    base[c] = 0 if v is None or str(v).strip() == "" else v
+                else:
+                    base[c] = "" if v is None else str(v).strip()
+            for c in ["Ingeniero", "Linea", "Prioridad"]:
+                base[c] = base[c] or defaults.get(c, "")
+
+            rec = nuevo_registro(base, avance["ID_Solicitud"])
+            errs = validate_record(rec)
+            if errs:
+                rechazados_bloque.append((fila + 1, json.dumps(base, default=str, ensure_ascii=False), "; ".join(errs)))
+            else:
+                registros.append(rec)
+
+            if len(registros) + len(rechazados_bloque) >= IMPORT_CHUNK:
+                ingest_solicitud(
+                    registros, usuario, rol, "Solicitud masiva creada",
+                    extra=_avance_importacion(id_importacion, fila, len(registros), rechazados_bloque, False),
+                )
+                avance["procesadas"] = fila
+                avance["insertadas"] += len(registros)
+                avance["rechazadas"] += len(rechazados_bloque)
+                registros, rechazados_bloque = [], []
+                yield avance
+
+        ingest_solicitud(
+            registros, usuario, rol, "Solicitud masiva creada",
+            extra=_avance_importacion(id_importacion, max(fila, avance["procesadas"]), len(registros), rechazados_bloque, True),
+        )
+        avance["procesadas"] = max(fila, avance["procesadas"])
+        avance["insertadas"] += len(registros)
+        avance["rechazadas"] += len(rechazados_bloque)
+        avance["completa"] = True
+        yield avance
+    finally:
+        wb.close()
+
+# ---------------------------
+# JOBS (trabajos en segundo plano)
+# ---------------------------
+# Importaciones, reporte completo y vistas previas corren en un pool de workers del proceso, no en el hilo del
+# script: un rerun o refrescar la página no los corta. El estado vive en la tabla jobs y los resultados en JOBS_DIR.
+# Pensado para un solo proceso de Streamlit: al arrancar, lo que quedó EN_PROCESO se vuelve a encolar.
+JOB_WORKERS = 2
+JOB_RETENCION_S = 24 * 3600
+JOBS_PANEL = 5
+JOB_ACTIVOS = ("PENDIENTE", "EN_PROCESO")
+
+def _job_avance(id_job: str, progreso: float, mensaje: str) -> None:
+    conn = db()
+    conn.execute("UPDATE jobs SET Progreso = ?, Mensaje = ? WHERE ID_Job = ?", (progreso, mensaje, id_job))
+    conn.commit()
+    conn.close()
+
+def _job_importacion(params: dict, avance: Callable[[float, str], None], destino: Path) -> str:
+    ultimo = None
+    for ultimo in importar_excel(
+        Path(params["ruta"]), params["id_importacion"], params["nombre"], params["defaults"], params["usuario"], params["rol"],
+    ):
+        frac = min(ultimo["procesadas"] / ultimo["total"], 1.0) if ultimo["total"] else 1.0
+        avance(frac, f"{ultimo['procesadas']} / {ultimo['total']} filas · {ultimo['insertadas']} guardadas")
+    Path(params["ruta"]).unlink(missing_ok=True)
+    if ultimo["rechazadas"]:
+        write_excel({"Rechazados": rechazos_importacion(params["id_importacion"])}, destino)
+    return (
+        f"Solicitud masiva {ultimo['ID_Solicitud']}: {ultimo['insertadas']} materiales guardados, "
+        f"{ultimo['rechazadas']} rechazados."
+    )
+
+def _job_reporte_completo(params: dict, avance: Callable[[float, str], None], destino: Path) -> str:
+    avance(0.1, "Calculando conteo semanal…")
+    semanal = conteo_semanal()
+    avance(0.3, "Escribiendo Excel…")
+    write_excel(
+        {
+            "Materiales": ("SELECT * FROM materiales", []),
+            "Historial": ("SELECT * FROM historial ORDER BY Fecha_Evento DESC", []),
+            "Archivos": ("SELECT * FROM archivos", []),
+            "Semanal": semanal,
+        },
+        destino,
+    )
+    return "Reporte completo listo."
+
+def _job_previews(params: dict, avance: Callable[[float, str], None], destino: Path) -> str:
+    return "Vista previa lista." if generar_previews(params["sha"], params["nombre"]) else "Sin vista previa."
+
+# Tipo -> (handler, etiqueta, nombre del archivo de resultado). El handler recibe (params, avance, destino) y
+# regresa el mensaje final; si escribe `destino`, ese archivo queda como resultado descargable.
+JOB_TIPOS: Dict[str, tuple[Callable[[dict, Callable[[float, str], None], Path], str], str, str]] = {
+    "importacion": (_job_importacion, "Importación Excel", "rechazados.xlsx"),
+    "reporte_completo": (_job_reporte_completo, "Reporte completo", "Bosch_Material_Management_Reporte.xlsx"),
+    "previews": (_job_previews, "Vista previa", ""),
+}
+
+class JobRunner:
+    """Pool de workers para la tabla jobs; al crearse limpia resultados viejos y retoma lo pendiente."""
+
+    def __init__(self, workers: int):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        conn = db()
+        with conn:
+            conn.execute("UPDATE jobs SET Estado = 'PENDIENTE' WHERE Estado = 'EN_PROCESO'")
+        pendientes = [r["ID_Job"] for r in conn.execute("SELECT ID_Job FROM jobs WHERE Estado = 'PENDIENTE' ORDER BY Fecha_Creacion")]
+        conn.close()
+        limpiar_jobs()
+        for id_job in pendientes:
+            self.submit(id_job)
+
+    def submit(self, id_job: str) -> None:
+        self._pool.submit(self._run, id_job)
+
+    def _run(self, id_job: str) -> None:
+        conn = db()
+        try:
+            with conn:
+                tomado = conn.execute(
+                    "UPDATE jobs SET Estado = 'EN_PROCESO', Fecha_Inicio = ?, Intentos = Intentos + 1 "
+                    "WHERE ID_Job = ? AND Estado = 'PENDIENTE'",
+                    (now_iso(), id_job),
+                ).rowcount
+            job = conn.execute("SELECT Tipo, Params FROM jobs WHERE ID_Job = ?", (id_job,)).fetchone()
+        finally:
+            conn.close()
+        if not tomado:
+            return
+
+        handler = JOB_TIPOS[job["Tipo"]][0]
+        destino = JOBS_DIR / f"{id_job}.out"
+        try:
+            with cronometro(f"job.{job['Tipo']}"):
+                mensaje = handler(json.loads(job["Params"]), lambda p, m: _job_avance(id_job, p, m), destino)
+            estado, resultado = "COMPLETO", (destino.name if destino.exists() else None)
+        except Exception as e:
+            destino.unlink(missing_ok=True)
+            estado, resultado, mensaje = "ERROR", None, str(e) or e.__class__.__name__
+
+        conn = db()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET Estado = ?, Progreso = CASE WHEN ? = 'COMPLETO' THEN 1 ELSE Progreso END, "
+                "Mensaje = ?, Resultado = ?, Fecha_Fin = ? WHERE ID_Job = ?",
+                (estado, estado, mensaje, resultado, now_iso(), id_job),
+            )
+        conn.close()
+
+@_por_proceso
+def job_runner() -> JobRunner:
+    return JobRunner(JOB_WORKERS)
+
+def encolar_job(tipo: str, params: dict, usuario: str, llave: Optional[str] = None) -> str:
+    """Registra un job y lo manda al pool. Con `llave`, si ya hay uno igual activo (o completo con resultado), regresa ese."""
+    conn = db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if llave:
+            row = conn.execute(
+                "SELECT ID_Job FROM jobs WHERE Llave = ? AND (Estado IN ('PENDIENTE', 'EN_PROCESO') OR "
+                "(Estado = 'COMPLETO' AND Resultado IS NOT NULL)) ORDER BY Fecha_Creacion DESC LIMIT 1",
+                (llave,),
+            ).fetchone()
+            if row:
+                conn.rollback()
+                return row["ID_Job"]
+        id_job = f"JOB-{uuid.uuid4().hex[:12].upper()}"
+        conn.execute(
+            "INSERT INTO jobs (ID_Job, Tipo, Llave, Params, Estado, Progreso, Mensaje, Usuario, Fecha_Creacion, Intentos) "
+            "VALUES (?, ?, ?, ?, 'PENDIENTE', 0, 'En cola', ?, ?, 0)",
+            (id_job, tipo, llave, json.dumps(params), usuario, now_iso()),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    job_runner().submit(id_job)
+    return id_job
+
+def reintentar_job(id_job: str) -> None:
+    conn = db()
+    with conn:
+        n = conn.execute("UPDATE jobs SET Estado = 'PENDIENTE', Mensaje = 'En cola' WHERE ID_Job = ? AND Estado = 'ERROR'", (id_job,)).rowcount
+    conn.close()
+    if n:
+        job_runner().submit(id_job)
+
+def listar_jobs(usuario: str, tipos: tuple[str, ...], limite: int = JOBS_PANEL) -> list[dict]:
+    conn = db()
+    rows = conn.execute(
+        f"SELECT * FROM jobs WHERE Usuario = ? AND Tipo IN ({','.join('?' * len(tipos))}) "
+        "ORDER BY Fecha_Creacion DESC LIMIT ?",
+        (usuario, *tipos, limite),
+    ).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def limpiar_jobs(max_age_s: int = JOB_RETENCION_S) -> int:
+    """Borra jobs terminados más viejos que max_age_s junto con su archivo de resultado, y los Excel subidos para
+    importar (import_*.xlsx) que ya ningún job referencia."""
+    corte = (datetime.now() - timedelta(seconds=max_age_s)).isoformat(timespec="seconds")
+    conn = db()
+    with conn:
+        viejos = conn.execute(
+            "SELECT ID_Job, Resultado FROM jobs WHERE Estado IN ('COMPLETO', 'ERROR') AND Fecha_Fin < ?", (corte,)
+        ).fetchall()
+        conn.executemany("DELETE FROM jobs WHERE ID_Job = ?", [(r["ID_Job"],) for r in viejos])
+        # Una importación que falló o se abandonó deja su Excel en disco (solo la exitosa lo borra). Se conserva
+        # mientras algún job que siga en la tabla lo use: uno en cola, en proceso o un ERROR que aún se puede reintentar.
+        en_uso = {json.loads(r["Params"]).get("ruta") for r in conn.execute("SELECT Params FROM jobs WHERE Tipo = 'importacion'")}
+    conn.close()
+    for r in viejos:
+        if r["Resultado"]:
+            (JOBS_DIR / r["Resultado"]).unlink(missing_ok=True)
+    limite = time.time() - max_age_s
+    for ruta in JOBS_DIR.glob("import_*.xlsx"):
+        if str(ruta) not in en_uso and ruta.stat().st_mtime < limite:
+            ruta.unlink(missing_ok=True)
+    return len(viejos)